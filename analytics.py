@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""analytics.py - Offline aggregates over games and scores.
+
+Streams Game, GameArchive and Score entities, either from the live
+datastore through remote_api in cursor-paged batches or from the output
+files of a datastore export, and keeps only a few integers per game and
+per move in compact arrays. Turn histories are decoded lazily, one move
+at a time. The aggregates are:
+ - the win rate of each secret word,
+ - the distribution of misses by word difficulty, from the Scores,
+ - the hit rate of each guessed letter.
+They are computed with NumPy and written as a compressed .npz file of
+columns. Without NumPy they are computed in Python and written as JSON.
+
+    python analytics.py --host your-app-id.appspot.com --output stats.npz
+    python analytics.py --export path/to/output-* --output stats.npz
+"""
+
+import argparse
+import json
+import string
+import sys
+from array import array
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PAGE_SIZE = 500
+LETTERS = string.ascii_lowercase
+
+
+def iter_query(query, page_size=PAGE_SIZE):
+    """Yields the results of an ndb query one cursor page at a time, so
+    only one page is held in memory."""
+    cursor, more = None, True
+    while more:
+        page, cursor, more = query.fetch_page(page_size, start_cursor=cursor)
+        for entity in page:
+            yield entity
+        more = more and cursor is not None
+
+
+def iter_datastore(page_size=PAGE_SIZE):
+    """Yields every Game, GameArchive and Score in the datastore."""
+    from google.appengine.ext import ndb
+    from models import Game, GameArchive, Score
+    # Keep the context from caching every entity read.
+    context = ndb.get_context()
+    context.set_cache_policy(False)
+    context.set_memcache_policy(False)
+    for model in (Game, GameArchive, Score):
+        for entity in iter_query(model.query(), page_size):
+            yield entity
+
+
+def iter_export(paths):
+    """Yields the entities stored in the output files of a datastore
+    export, skipping kinds other than Game, GameArchive and Score."""
+    from google.appengine.api.files import records
+    from google.appengine.datastore import entity_pb
+    from google.appengine.ext import ndb
+    import models
+    kinds = ('Game', 'GameArchive', 'Score')
+    adapter = ndb.ModelAdapter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for record in records.RecordsReader(f):
+                pb = entity_pb.EntityProto(record)
+                if pb.key().path().element_list()[-1].type() in kinds:
+                    yield adapter.pb_to_entity(pb)
+
+
+def iter_moves(game):
+    """Yields (letter, hit) for each move of a Game or GameArchive,
+    decoding legacy turn histories as well as the moves encoding."""
+    from engine import decode_moves
+    if getattr(game, 'moves', None):
+        for move in decode_moves(game.moves):
+            yield move
+    elif getattr(game, 'turn_history', None):
+        for turn in game.turn_history:
+            yield turn['guess'], turn['guess'] in game.secret_word
+
+
+class Columns(object):
+    """Compact per-game, per-move and per-score columns."""
+
+    def __init__(self):
+        self.words = []
+        self._word_ids = {}
+        # One entry per finished game.
+        self.game_word = array('l')
+        self.game_won = array('b')
+        # One entry per move.
+        self.move_letter = array('b')
+        self.move_hit = array('b')
+        # One entry per Score.
+        self.score_difficulty = array('l')
+        self.score_misses = array('l')
+
+    def _word_id(self, word):
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = self._word_ids[word] = len(self.words)
+            self.words.append(word)
+        return word_id
+
+    def add(self, entity):
+        """Adds a Game, GameArchive or Score."""
+        kind = entity.key.kind()
+        if kind == 'Score':
+            self.score_difficulty.append(entity.difficulty)
+            self.score_misses.append(entity.misses)
+            return
+        word_letters = set(entity.secret_word)
+        misses = 0
+        guessed = set()
+        for letter, hit in iter_moves(entity):
+            if letter not in LETTERS:
+                continue
+            self.move_letter.append(LETTERS.index(letter))
+            self.move_hit.append(hit)
+            guessed.add(letter)
+            misses += not hit
+        won = word_letters <= guessed
+        if won or misses >= entity.allowed_misses:
+            # Active and expired games have no outcome.
+            self.game_word.append(self._word_id(entity.secret_word))
+            self.game_won.append(won)
+
+
+def aggregate_numpy(columns):
+    """Returns a dict of NumPy arrays with the aggregates."""
+    np = numpy
+    words = len(columns.words)
+    game_word = np.frombuffer(columns.game_word, dtype=np.dtype('l'))
+    game_won = np.frombuffer(columns.game_won, dtype=np.int8)
+    word_games = np.bincount(game_word, minlength=words)
+    word_wins = np.bincount(game_word, weights=game_won, minlength=words)
+
+    difficulty = np.frombuffer(columns.score_difficulty,
+                               dtype=np.dtype('l'))
+    misses = np.frombuffer(columns.score_misses, dtype=np.dtype('l'))
+    # misses_by_difficulty[d, m] counts Scores of difficulty d with m
+    # misses.
+    shape = (difficulty.max() + 1 if difficulty.size else 0,
+             misses.max() + 1 if misses.size else 0)
+    misses_by_difficulty = np.zeros(shape, dtype=np.int64)
+    np.add.at(misses_by_difficulty, (difficulty, misses), 1)
+
+    letter = np.frombuffer(columns.move_letter, dtype=np.int8)
+    hit = np.frombuffer(columns.move_hit, dtype=np.int8)
+    letter_guesses = np.bincount(letter, minlength=len(LETTERS))
+    letter_hits = np.bincount(letter, weights=hit, minlength=len(LETTERS))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'words': np.array(columns.words),
+            'word_games': word_games,
+            'word_wins': word_wins.astype(np.int64),
+            'word_win_rate': word_wins / word_games,
+            'misses_by_difficulty': misses_by_difficulty,
+            'letters': np.array(list(LETTERS)),
+            'letter_guesses': letter_guesses,
+            'letter_hits': letter_hits.astype(np.int64),
+            'letter_hit_rate': letter_hits / letter_guesses,
+        }
+
+
+def _rate(numerator, denominator):
+    return float(numerator) / denominator if denominator else None
+
+
+def aggregate_python(columns):
+    """Returns a dict of lists with the aggregates, for when NumPy is
+    not installed."""
+    word_games = Counter(columns.game_word)
+    word_wins = Counter(word for word, won
+                        in zip(columns.game_word, columns.game_won) if won)
+    misses_by_difficulty = {}
+    for difficulty, misses in zip(columns.score_difficulty,
+                                  columns.score_misses):
+        counts = misses_by_difficulty.setdefault(difficulty, Counter())
+        counts[misses] += 1
+    letter_guesses = Counter(columns.move_letter)
+    letter_hits = Counter(letter for letter, hit
+                          in zip(columns.move_letter, columns.move_hit)
+                          if hit)
+    words = range(len(columns.words))
+    letters = range(len(LETTERS))
+    return {
+        'words': columns.words,
+        'word_games': [word_games[word] for word in words],
+        'word_wins': [word_wins[word] for word in words],
+        'word_win_rate': [_rate(word_wins[word], word_games[word])
+                          for word in words],
+        'misses_by_difficulty': dict(
+            (difficulty, dict(counts))
+            for difficulty, counts in misses_by_difficulty.iteritems()),
+        'letters': list(LETTERS),
+        'letter_guesses': [letter_guesses[letter] for letter in letters],
+        'letter_hits': [letter_hits[letter] for letter in letters],
+        'letter_hit_rate': [_rate(letter_hits[letter],
+                                  letter_guesses[letter])
+                            for letter in letters],
+    }
+
+
+def connect(host):
+    """Points the datastore APIs at an app through remote_api."""
+    from google.appengine.ext.remote_api import remote_api_stub
+    remote_api_stub.ConfigureRemoteApiForOAuth(host, '/_ah/remote_api')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--host', help='app to read through remote_api')
+    source.add_argument('--export', nargs='+',
+                        help='output files of a datastore export')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--output', required=True,
+                        help='.npz file to write, or .json without NumPy')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv if argv is not None else sys.argv[1:])
+    if options.host:
+        connect(options.host)
+        entities = iter_datastore(options.page_size)
+    else:
+        entities = iter_export(options.export)
+    columns = Columns()
+    for entity in entities:
+        columns.add(entity)
+    if numpy is not None:
+        numpy.savez_compressed(options.output, **aggregate_numpy(columns))
+    else:
+        with open(options.output, 'w') as f:
+            json.dump(aggregate_python(columns), f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
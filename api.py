@@ -1,18 +1,35 @@
 import endpoints
 import json
-from collections import OrderedDict
 from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 
-from models import User, Game, Score
+from google.appengine.api import datastore_errors, oauth
+from google.appengine.ext import ndb
+
+from models import User, Game, GameArchive, Score
+from models import GAME_LIST_PROJECTION, SCORE_LIST_PROJECTION
 from models import (StringMessage, NewGameForm, GameForm, MakeMoveForm,
-                    ScoreForms, UserGameForms, UserRankingForms)
-from utils import get_by_urlsafe
+                    MakeMovesForm, MoveResultForm, MoveResultForms,
+                    ScoreForms, UserGameForms, UserRankingForms,
+                    UserRankForm, HintForm, GameForms, NewUsersForm,
+                    NewUsersResultForm, NewGamesForm)
+from utils import get_by_urlsafe_async, key_from_urlsafe, cursor_from_urlsafe
+import game_cache
+import instrumentation
+import leaderboard
+import rankings
+import solver
+from engine import REPEAT, REPEAT_MESSAGE, is_letter, result_message
+from instrumentation import instrumented
 
 
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
                                            email=messages.StringField(2))
+USER_LIST_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    page_size=messages.IntegerField(2),
+    cursor=messages.StringField(3))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 GET_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1))
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
@@ -22,8 +39,154 @@ MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
 CANCEL_GAME_REQUEST = endpoints.ResourceContainer(
     urlsafe_game_key=messages.StringField(1))
 HIGH_SCORES_REQUEST = endpoints.ResourceContainer(
+    number_of_results=messages.IntegerField(1),
+    cursor=messages.StringField(2))
+USER_RANKINGS_REQUEST = endpoints.ResourceContainer(
     number_of_results=messages.IntegerField(1))
-MEMCACHE_MISSES_REMAINING = 'MISSES REMAINING'
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(
+    MakeMovesForm,
+    urlsafe_game_key=messages.StringField(1))
+NEW_USERS_REQUEST = endpoints.ResourceContainer(NewUsersForm)
+NEW_GAMES_REQUEST = endpoints.ResourceContainer(NewGamesForm)
+# Most users or games created by one bulk request.
+MAX_BULK_SIZE = 5000
+USER_RANK_REQUEST = endpoints.ResourceContainer(
+    user_name=messages.StringField(1),
+    number_of_neighbors=messages.IntegerField(2, default=0))
+# Most users returned above and below a user by get_user_rank.
+MAX_NEIGHBORS = 25
+CONFLICT_MESSAGE = 'The game was changed by another move. Please try again!'
+
+
+def _page_size(size, default):
+    """Returns size, or default if it is not given, capped at
+    MAX_PAGE_SIZE. Raises BadRequestException if it is less than 1."""
+    if size is None:
+        return default
+    if size < 1:
+        raise endpoints.BadRequestException(
+            'The page size must be at least 1!')
+    return min(size, MAX_PAGE_SIZE)
+
+
+def _fetch_page_for_user(request, query_for, projection):
+    """Returns (user, entities, cursor) for the User named in a
+    USER_LIST_REQUEST, where entities are a page of the results of the
+    projection query query_for(user_key) and cursor is the cursor of the
+    next page, if there is one. The query for the name-derived key runs
+    concurrently with the User lookup and is only repeated for Users that
+    are not keyed by name yet."""
+    page_size = _page_size(request.page_size, DEFAULT_PAGE_SIZE)
+    start_cursor = cursor_from_urlsafe(request.cursor)
+
+    def fetch_page(key):
+        return query_for(key).fetch_page_async(
+            page_size, projection=projection, start_cursor=start_cursor)
+    user_future = User.get_by_name_async(request.user_name)
+    key = User.key_for_name(request.user_name) if request.user_name else None
+    page_future = fetch_page(key) if key else None
+    user = user_future.get_result()
+    if not user:
+        raise endpoints.NotFoundException(
+            'A User with that name does not exist!')
+    if user.key != key:
+        page_future = fetch_page(user.key)
+    try:
+        entities, cursor, more = page_future.get_result()
+    except datastore_errors.BadRequestError:
+        # The cursor is of another query.
+        if start_cursor is None:
+            raise
+        raise endpoints.BadRequestException('Invalid cursor')
+    return user, entities, cursor.urlsafe() if more and cursor else None
+
+
+def _check_user_name(user_name):
+    """Raises BadRequestException unless user_name is a valid name for a
+    new User."""
+    if not user_name:
+        raise endpoints.BadRequestException(
+            'Username is required!')
+    elif not user_name.isalnum():
+        raise endpoints.BadRequestException(
+            'Username must be alphanumeric!')
+    elif len(user_name) < 3:
+        raise endpoints.BadRequestException(
+            'Username must be at least 3 characters!')
+
+
+def _check_bulk_names(names):
+    """Raises BadRequestException if a bulk request has too many or
+    repeated user names."""
+    if len(names) > MAX_BULK_SIZE:
+        raise endpoints.BadRequestException(
+            'At most {} users can be given at once!'.format(MAX_BULK_SIZE))
+    if len(set(names)) != len(names):
+        raise endpoints.BadRequestException(
+            'Each username may only be given once!')
+
+
+def _get_active_game(cache, urlsafe_game_key):
+    """Returns the active Game for a urlsafe key, read through cache.
+    Raises NotFoundException if there is no such game or it is over."""
+    game = cache.get(urlsafe_game_key)
+    if not game:
+        raise endpoints.NotFoundException('No game was found!')
+    if game.game_over:
+        raise endpoints.NotFoundException('That game is already over. '
+                                          'Please enter an active game!')
+    return game
+
+
+def _check_guess(guess):
+    """Returns the lowercase guess. Raises BadRequestException unless it is
+    a single letter."""
+    guess = guess.lower()
+    if not len(guess) == 1:
+        raise endpoints.BadRequestException(
+            'Exactly 1 character must be entered!')
+    elif not is_letter(guess):
+        raise endpoints.BadRequestException(
+            'Non-alphabetic character entered!')
+    return guess
+
+
+def _save_moves(cache, game, state, previous_moves, message):
+    """Saves a game after moves were applied to its engine state and
+    returns its GameForm with message. previous_moves are the game's moves
+    before them. The new state is claimed in the game cache first, so a
+    concurrent move on the same game fails with a ConflictException
+    instead of being lost, and the stored game is re-checked in a
+    transaction before the moves are written onto it, so a game ended,
+    deleted or changed elsewhere is not overwritten."""
+    game.sync_engine(state)
+    if state.over:
+        # end_game_async sets this too, but the cached state needs it now.
+        game.game_over = True
+    if not cache.claim(game):
+        raise endpoints.ConflictException(CONFLICT_MESSAGE)
+    try:
+        # The write and the form run concurrently.
+        if state.over:
+            # end_game saves the game along with its Score.
+            save_future = game.end_game_async(previous_moves, state.won)
+        else:
+            save_future = game.save_moves_async(previous_moves)
+        form_future = game.to_form_async(message)
+        saved = save_future.get_result()
+        if state.over and saved and saved.won:
+            leaderboard.record_win(saved)
+    except Exception:
+        # The datastore is the source of truth if the write failed.
+        game_cache.delete(game.key)
+        raise
+    if not saved:
+        # The cached state was stale. A game that was deleted or ended
+        # meanwhile is reported as such.
+        game_cache.delete(game.key)
+        _get_active_game(cache, game.key.urlsafe())
+        raise endpoints.ConflictException(CONFLICT_MESSAGE)
+    return form_future.get_result()
 
 
 @endpoints.api(name='hangman', version='v1')
@@ -34,23 +197,14 @@ class HangmanApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User. Requires a unique username."""
-        if not request.user_name:
-            raise endpoints.BadRequestException(
-                'Username is required!')
-        elif User.query(User.name == request.user_name).get():
+        _check_user_name(request.user_name)
+        if not User.create_async(request.user_name,
+                                 email=request.email).get_result():
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        elif not request.user_name.isalnum():
-            raise endpoints.BadRequestException(
-                'Username must be alphanumeric!')
-        elif len(request.user_name) < 3:
-            raise endpoints.BadRequestException(
-                'Username must be at least 3 characters!')
-        user = User(name=request.user_name, email=request.email, wins=0,
-                    total_games=0, won_games_difficulty=0, misses=0)
-        user.put()
         return StringMessage(message='User {} created!'.format(
             request.user_name))
 
@@ -59,131 +213,210 @@ class HangmanApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Creates new game."""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name_async(request.user_name).get_result()
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
         try:
-            game = Game.new_game(user.key, request.allowed_misses)
-        except ValueError:
-            raise endpoints.BadRequestException('Allowed misses must be '
-                                                ' between 6 and 10!')
-        # Use a task queue to update the average misses remaining.
-        # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_misses')
+            game = Game.new_game_async(
+                user.key, request.allowed_misses,
+                min_difficulty=request.min_difficulty,
+                max_difficulty=request.max_difficulty,
+                min_length=request.min_length,
+                max_length=request.max_length,
+                user_name=user.name).get_result()
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        game_cache.store(game)
         return game.to_form('Enjoy playing Hangman!')
 
+    @endpoints.method(request_message=NEW_USERS_REQUEST,
+                      response_message=NewUsersResultForm,
+                      path='users',
+                      name='create_users',
+                      http_method='POST')
+    @instrumented
+    def create_users(self, request):
+        """Create several Users at once. Names that are taken are skipped
+        and returned as existing."""
+        names = [user.user_name for user in request.users]
+        _check_bulk_names(names)
+        for name in names:
+            _check_user_name(name)
+        created, existing = User.create_multi_async(
+            [(user.user_name, user.email)
+             for user in request.users]).get_result()
+        return NewUsersResultForm(created=[user.name for user in created],
+                                  existing=existing)
+
+    @endpoints.method(request_message=NEW_GAMES_REQUEST,
+                      response_message=GameForms,
+                      path='games',
+                      name='new_games',
+                      http_method='POST')
+    @instrumented
+    def new_games(self, request):
+        """Creates a new game for each of several users."""
+        _check_bulk_names(request.user_names)
+        users = ndb.get_multi([User.key_for_name(name)
+                               for name in request.user_names])
+        # Users not keyed by name yet are looked up concurrently.
+        legacy = dict((name, User.get_by_name_async(name))
+                      for name, user in zip(request.user_names, users)
+                      if not user)
+        users = [user or legacy[name].get_result()
+                 for name, user in zip(request.user_names, users)]
+        missing = [name for name, user in zip(request.user_names, users)
+                   if not user]
+        if missing:
+            raise endpoints.NotFoundException(
+                'No Users with the names {} exist!'.format(
+                    ', '.join(missing)))
+        try:
+            games = Game.new_games_async(
+                users, request.allowed_misses,
+                min_difficulty=request.min_difficulty,
+                max_difficulty=request.max_difficulty,
+                min_length=request.min_length,
+                max_length=request.max_length).get_result()
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        game_cache.store_multi(games)
+        return GameForms(items=[game.to_form('Enjoy playing Hangman!')
+                                for game in games])
+
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = game_cache.GameCache().get(request.urlsafe_game_key)
         if game:
             if not game.game_over:
-                return game.to_form('Time to take a turn!')
+                return game.to_form_async('Time to take a turn!').get_result()
             else:
-                return game.to_form('The game is over!')
+                return game.to_form_async('The game is over!').get_result()
         else:
             raise endpoints.NotFoundException('No game was found!')
 
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/hint/{urlsafe_game_key}',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    def get_hint(self, request):
+        """Suggest the letter most likely to be in the secret word."""
+        game = _get_active_game(game_cache.GameCache(),
+                                request.urlsafe_game_key)
+        hint = solver.get_solver().hint(game.guessed_word,
+                                        game.missed_letters)
+        if not hint:
+            raise endpoints.NotFoundException('No letters are left to guess!')
+        letter, candidates, with_letter = hint
+        return HintForm(letter=letter, candidates=candidates,
+                        candidates_with_letter=with_letter)
+
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @instrumented
     def make_move(self, request):
         """Makes a move. Returns a game state with message."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if not game:
-            raise endpoints.NotFoundException('No game was found!')
-        if game.game_over:
-            raise endpoints.NotFoundException('That game is already over. '
-                                              'Please enter an active game!')
+        cache = game_cache.GameCache()
+        game = _get_active_game(cache, request.urlsafe_game_key)
+        guess = _check_guess(request.guess)
+        state = game.engine()
+        result = state.guess(guess)
+        if result == REPEAT:
+            return game.to_form_async(REPEAT_MESSAGE).get_result()
+        previous_moves = game.moves
+        game.record_move(guess, result)
+        return _save_moves(cache, game, state, previous_moves,
+                           result_message(result, state))
+
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MoveResultForms,
+                      path='game/moves/{urlsafe_game_key}',
+                      name='make_moves',
+                      http_method='PUT')
+    @instrumented
+    def make_moves(self, request):
+        """Makes a list of moves in order, stopping if the game ends.
+        Returns the result of each move and the final game state."""
+        cache = game_cache.GameCache()
+        game = _get_active_game(cache, request.urlsafe_game_key)
+        if not request.guesses:
+            raise endpoints.BadRequestException(
+                'At least 1 guess must be entered!')
+        # Every guess is checked before any is applied.
+        guesses = [_check_guess(guess) for guess in request.guesses]
+        state = game.engine()
+        results = []
+        previous_moves = game.moves
+        moves = 0
+        for guess in guesses:
+            result = state.guess(guess)
+            if result == REPEAT:
+                message = REPEAT_MESSAGE
+            else:
+                game.record_move(guess, result)
+                message = result_message(result, state)
+                moves += 1
+            results.append(MoveResultForm(guess=guess, result=result,
+                                          message=message))
+            if state.over:
+                break
+        if not moves:
+            form = game.to_form_async(message).get_result()
         else:
-            guess = request.guess.lower()
-            if not len(guess) == 1:
-                raise endpoints.BadRequestException(
-                    'Exactly 1 character must be entered!')
-            elif not guess.isalpha():
-                raise endpoints.BadRequestException(
-                    'Non-alphabetic character entered!')
-            elif guess in game.missed_letters or guess in game.guessed_word:
-                        return game.to_form('That letter was already '
-                                            'guessed. Try a different '
-                                            'letter!')
-            # Converting guessed_word to list lets you easily replace
-            # dashes with correctly guessed letters.
-            guessed_word_list = list(game.guessed_word)
-            if guess in game.secret_word:
-                message = 'Guessed letter is in secret word!'
-                # Add the letter to guessed_word in place of dashes
-                for index, ch in enumerate(game.secret_word):
-                    if ch == guess:
-                        guessed_word_list[index] = ch
-                game.guessed_word = ''.join(guessed_word_list)
-                # End the game if the user guessed the full secret word
-                if game.guessed_word == game.secret_word:
-                    game.end_game(True)
-                    message += ' You win! The secret word is %s.' \
-                               % game.secret_word
-            else:  # the user guessed a letter NOT in the secret word
-                game.misses_left -= 1
-                game.missed_letters += guess
-                message = 'Guessed letter not in secret word!'
-            if game.misses_left < 1:
-                game.end_game(False)
-                message += ' You lost! The secret word was %s.' \
-                           % game.secret_word
-            # Save data for turn history. Used OrderedDict so it
-            # maintains the proper order.
-            history = OrderedDict()
-            history['guess'] = str(guess)
-            history['result'] = str(message)
-            history['word'] = str(game.guessed_word)
-            game.turn_history.append(history)
-            game.put()
-            return game.to_form(message)
+            form = _save_moves(cache, game, state, previous_moves, message)
+        return MoveResultForms(results=results, game=form)
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_LIST_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @instrumented
     def get_user_scores(self, request):
-        """Returns all of an individual user's scores."""
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        """Returns a page of an individual user's scores."""
+        user, scores, cursor = _fetch_page_for_user(
+            request, lambda key: Score.query(Score.user == key),
+            SCORE_LIST_PROJECTION)
+        return ScoreForms(
+            items=[score.to_list_form(user.name) for score in scores],
+            cursor=cursor)
 
     @endpoints.method(request_message=HIGH_SCORES_REQUEST,
                       response_message=ScoreForms,
                       path='scores/high',
                       name='get_high_scores',
                       http_method='GET')
+    @instrumented
     def get_high_scores(self, request):
         """Returns a list of high scores of games that were won."""
-        # Scores are sorted by least amount of misses. A tiebreaker
-        # is word difficulty.
-        scores = \
-            Score.query(Score.won == True).order(
-                Score.misses).order(-Score.difficulty)
-        scores = scores.fetch(limit=request.number_of_results)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        # The first leaderboard.TOP_K scores are served from the cached
+        # leaderboard and later pages from the datastore.
+        items, cursor = leaderboard.get_page(
+            _page_size(request.number_of_results, leaderboard.TOP_K),
+            request.cursor)
+        return ScoreForms(items=items, cursor=cursor)
 
-    @endpoints.method(request_message=HIGH_SCORES_REQUEST,
+    @endpoints.method(request_message=USER_RANKINGS_REQUEST,
                       response_message=UserRankingForms,
                       path='scores/user-rankings',
                       name='get_user_rankings',
                       http_method='GET')
+    @instrumented
     def get_user_rankings(self, request):
         """Returns user rankings list"""
         # Users must have completed at least one game to be in the
@@ -198,74 +431,120 @@ class HangmanApi(remote.Service):
         return UserRankingForms(
             items=[user.to_rankings_form() for user in users])
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_RANK_REQUEST,
+                      response_message=UserRankForm,
+                      path='scores/user-rank/{user_name}',
+                      name='get_user_rank',
+                      http_method='GET')
+    @instrumented
+    def get_user_rank(self, request):
+        """Returns a user's rank and the users ranked around them."""
+        neighbors = request.number_of_neighbors or 0
+        if neighbors < 0:
+            raise endpoints.BadRequestException(
+                'The number of neighbors must not be negative!')
+        user = User.get_by_name_async(request.user_name).get_result()
+        if not user:
+            raise endpoints.NotFoundException(
+                'A User with that name does not exist!')
+        if user.win_ratio is None:
+            raise endpoints.NotFoundException(
+                'That User has not completed any games!')
+        rank, total_ranked, above, below = rankings.get_rank_async(
+            user, neighbors=min(neighbors, MAX_NEIGHBORS)).get_result()
+        return UserRankForm(
+            rank=rank,
+            total_ranked=total_ranked,
+            user=user.to_rankings_form(),
+            above=[other.to_rankings_form() for other in above],
+            below=[other.to_rankings_form() for other in below])
+
+    @endpoints.method(request_message=USER_LIST_REQUEST,
                       response_message=UserGameForms,
                       path='games/active/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
+    @instrumented
     def get_user_games(self, request):
-        """Returns all of an individual user's active games."""
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                'A User with that name does not exist!')
-        games = Game.query(Game.user == user.key, Game.game_over == False)
-        return UserGameForms(items=[game.to_form('Time to take a turn!') for game in games])
+        """Returns a page of an individual user's active games."""
+        user, games, cursor = _fetch_page_for_user(
+            request,
+            lambda key: Game.query(Game.user == key, Game.game_over == False),
+            GAME_LIST_PROJECTION)
+        return UserGameForms(
+            items=[game.to_list_form(user.name, 'Time to take a turn!')
+                   for game in games],
+            cursor=cursor)
 
     @endpoints.method(request_message=CANCEL_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/cancel/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrumented
     def cancel_game(self, request):
         """Cancel game by deleting it from datastore."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = get_by_urlsafe_async(request.urlsafe_game_key,
+                                    Game).get_result()
         if not game:
             raise endpoints.NotFoundException(
                 'No game was found!')
         if game.game_over:
             return StringMessage(message='Failed to cancel: Game already over!')
-        else:
-            game.key.delete()
-            return StringMessage(message='Game has been cancelled!')
+        # Evicted first, so no move saves the cached copy afterwards.
+        game_cache.delete(game.key)
+        if not Game.cancel_async(game.key).get_result():
+            return StringMessage(message='Failed to cancel: Game already over!')
+        return StringMessage(message='Game has been cancelled!')
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/history/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @instrumented
     def get_game_history(self, request):
         """Returns turn history for a game."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = get_by_urlsafe_async(request.urlsafe_game_key,
+                                    Game).get_result()
+        if not game:
+            # Finished games are moved to the archive by the sweeper.
+            game = GameArchive.key_for_game(
+                key_from_urlsafe(request.urlsafe_game_key)).get()
         if not game:
             raise endpoints.NotFoundException('No game was found!')
-        elif not game.turn_history:
+        history = game.history()
+        if not history:
             raise endpoints.NotFoundException('No history for this game was found!')
         else:
-            # Convert turn history from OrderedDict to JSON.
-            history = json.dumps(game.turn_history)
-            # Remove the multiple \" added during JSON conversion
-            history = str(history).replace('\"', '')
-            return StringMessage(message=history)
+            return StringMessage(message=json.dumps(history))
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_misses',
                       name='get_average_misses_remaining',
                       http_method='GET')
+    @instrumented
     def get_average_misses(self, request):
-        """Get the cached average misses remaining"""
-        return StringMessage(message=memcache.get(MEMCACHE_MISSES_REMAINING) or '')
-
-    @staticmethod
-    def _cache_average_misses():
-        """Populates memcache with the average misses remaining for Games"""
-        games = Game.query(Game.game_over == False).fetch()
-        if games:
-            count = len(games)
-            total_misses_remaining = sum([game.misses_left
-                                         for game in games])
-            average = float(total_misses_remaining)/count
-            memcache.set(MEMCACHE_MISSES_REMAINING,
-                         'The average misses remaining is {:.2f}'.format(average))
+        """Get the average misses remaining from the active game counters"""
+        average = Game.average_misses_left_async().get_result()
+        if average is None:
+            return StringMessage(message='')
+        return StringMessage(
+            message='The average misses remaining is {:.2f}'.format(average))
+
+    @endpoints.method(response_message=StringMessage,
+                      path='admin/stats',
+                      name='get_stats',
+                      http_method='GET')
+    def get_stats(self, request):
+        """Returns the recorded endpoint and game cache statistics as JSON.
+        Admins only."""
+        try:
+            admin = oauth.is_current_user_admin(endpoints.EMAIL_SCOPE)
+        except oauth.Error:
+            admin = False
+        if not admin:
+            raise endpoints.ForbiddenException('Only admins can view stats!')
+        return StringMessage(message=json.dumps(instrumentation.report()))
 
 api = endpoints.api_server([HangmanApi])
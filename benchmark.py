@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+
+"""benchmark.py - In-process load test and benchmark of the Hangman API.
+
+Drives HangmanApi against the App Engine testbed stubs for the datastore,
+memcache, task queue and mail. A population of users plays interleaved
+games with a guess strategy, and for each endpoint the benchmark reports
+throughput over wall-clock time, latency percentiles, RPCs per call by
+service and datastore bytes written per entity as JSON, so runs can be
+compared. With --threads N the games are played by N threads at once, so
+concurrent moves on one game and transaction retries are exercised.
+
+With --startup N it instead starts N fresh processes with and N without
+the /_ah/warmup work and reports import and first request times, to
+measure cold starts.
+
+Requires the App Engine SDK on the path, for example:
+    PYTHONPATH=$SDK:$SDK/lib/... python benchmark.py --users 50 --output run.json
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from solver import FREQUENCY_ORDER
+
+
+def percentile(values, fraction):
+    """Returns the value at fraction (0..1) of the sorted values."""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+class RpcRecorder(object):
+    """Counts the API calls made through the apiproxy and the bytes of
+    entities written to the datastore, separately for each thread so that
+    concurrent calls are told apart."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def _counts(self):
+        counts = self.local
+        if not hasattr(counts, 'calls'):
+            counts.calls = defaultdict(int)
+            counts.put_entities = 0
+            counts.put_bytes = 0
+        return counts
+
+    def __call__(self, service, call, request, response):
+        counts = self._counts()
+        counts.calls[service] += 1
+        if service == 'datastore_v3' and call == 'Put':
+            for entity in request.entity_list():
+                counts.put_entities += 1
+                counts.put_bytes += entity.ByteSize()
+
+    def snapshot(self):
+        counts = self._counts()
+        return dict(counts.calls), counts.put_entities, counts.put_bytes
+
+
+class EndpointStats(object):
+    """Latencies, RPC counts and bytes written for one endpoint."""
+
+    def __init__(self):
+        self.latencies = []
+        self.rpcs = defaultdict(int)
+        self.put_entities = 0
+        self.put_bytes = 0
+        self.errors = 0
+        self.conflicts = 0
+        # Wall-clock span from the start of the first call to the end of
+        # the last one.
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, start, end):
+        self.latencies.append(end - start)
+        if self.first_start is None or start < self.first_start:
+            self.first_start = start
+        if self.last_end is None or end > self.last_end:
+            self.last_end = end
+
+    def report(self):
+        calls = len(self.latencies)
+        total = sum(self.latencies)
+        wall = self.last_end - self.first_start if calls else 0
+        return {
+            'calls': calls,
+            'errors': self.errors,
+            'conflicts': self.conflicts,
+            'throughput_per_sec': calls / wall if wall else None,
+            'latency_ms': {
+                'mean': 1000 * total / calls if calls else None,
+                'p50': 1000 * percentile(self.latencies, 0.5)
+                if calls else None,
+                'p90': 1000 * percentile(self.latencies, 0.9)
+                if calls else None,
+                'p99': 1000 * percentile(self.latencies, 0.99)
+                if calls else None,
+            },
+            'rpcs_per_call': dict((service, float(count) / calls)
+                                  for service, count
+                                  in self.rpcs.iteritems()) if calls else {},
+            'bytes_written_per_entity': float(self.put_bytes) /
+            self.put_entities if self.put_entities else None,
+        }
+
+
+class Benchmark(object):
+    """Runs a simulated population of players against HangmanApi."""
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.stats = defaultdict(EndpointStats)
+        self.recorder = RpcRecorder()
+        # Guards stats and the game lists shared by the worker threads.
+        self.lock = threading.Lock()
+        # The error of the last call made on each thread, if it failed.
+        self.last = threading.local()
+        self.wall_time = {}
+
+    def setup(self):
+        """Activates the testbed stubs and imports the API."""
+        self.setup_stubs()
+        import api
+        import models
+        self.api_module = api
+        self.models = models
+        self.api = api.HangmanApi()
+
+    def setup_stubs(self):
+        """Activates the testbed stubs."""
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import ndb, testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=self.options.root_path)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.testbed.init_urlfetch_stub()
+        ndb.get_context().set_cache_policy(False)
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'benchmark', self.recorder)
+
+    def teardown(self):
+        self.testbed.deactivate()
+
+    def call(self, endpoint, container, label=None, **fields):
+        """Calls an endpoint with a request built from fields and records
+        its latency and RPCs under label (the endpoint name by default)."""
+        request = container.combined_message_class(**fields)
+        before_calls, before_entities, before_bytes = \
+            self.recorder.snapshot()
+        self.last.error = None
+        start = time.time()
+        try:
+            response = getattr(self.api, endpoint)(request)
+        except Exception as error:
+            response = None
+            self.last.error = error
+        end = time.time()
+        after_calls, after_entities, after_bytes = self.recorder.snapshot()
+        if label is None and response is not None and \
+                getattr(response, 'game_over', False):
+            label = endpoint + ' (game over)'
+        with self.lock:
+            stats = self.stats[label or endpoint]
+            if self.last.error is not None:
+                stats.errors += 1
+                stats.conflicts += self.conflicted()
+            stats.add(start, end)
+            for service, count in after_calls.iteritems():
+                stats.rpcs[service] += count - before_calls.get(service, 0)
+            stats.put_entities += after_entities - before_entities
+            stats.put_bytes += after_bytes - before_bytes
+        return response
+
+    def conflicted(self):
+        """Returns whether the last call on this thread failed because a
+        concurrent move changed the game first."""
+        return isinstance(self.last.error,
+                          self.api_module.endpoints.ConflictException)
+
+    def in_threads(self, target):
+        """Runs target(worker) on options.threads threads, numbered from
+        0, and waits for them to finish."""
+        threads = [threading.Thread(target=self._worker, args=(target, n))
+                   for n in range(self.options.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _worker(self, target, worker):
+        from google.appengine.ext import ndb
+        # The in-context cache policy is set per thread.
+        ndb.get_context().set_cache_policy(False)
+        target(worker)
+
+    def guesses(self):
+        """Returns the order a player guesses letters in. Players using
+        hints fall back to it if get_hint fails."""
+        if self.options.strategy in ('frequency', 'hint'):
+            return list(FREQUENCY_ORDER)
+        letters = list(string.ascii_lowercase)
+        self.random.shuffle(letters)
+        return letters
+
+    def run(self):
+        api = self.api_module
+        options = self.options
+        names = ['player{}'.format(i) for i in range(options.users)]
+        for name in names:
+            self.call('create_user', api.USER_REQUEST, user_name=name,
+                      email='{}@example.com'.format(name))
+
+        games = []
+        for name in names:
+            for _ in range(options.games_per_user):
+                form = self.call('new_game', api.NEW_GAME_REQUEST,
+                                 user_name=name,
+                                 allowed_misses=options.allowed_misses)
+                if form is not None:
+                    games.append((form.urlsafe_key, self.guesses()))
+
+        # Games take turns so that up to options.concurrent_games are in
+        # progress at once, like many players polling and guessing. Each
+        # thread plays the active games round robin from its own offset.
+        active = games[:options.concurrent_games]
+        waiting = games[options.concurrent_games:]
+        start = time.time()
+        self.in_threads(lambda worker: self.play(
+            active, waiting, worker * len(active) // options.threads))
+        self.wall_time['games_sec'] = time.time() - start
+
+        # Completed games reach the rankings once their stats are folded,
+        # as the /tasks/fold_user_stats cron job does.
+        start = time.time()
+        cursor = None
+        while True:
+            cursor, _ = self.models.User.fold_stats_page(cursor)
+            if cursor is None:
+                break
+        self.wall_time['fold_sec'] = time.time() - start
+
+        start = time.time()
+        self.in_threads(self.read)
+        self.wall_time['reads_sec'] = time.time() - start
+
+    def play(self, active, waiting, turn):
+        """Plays turns of the active games, a list of [urlsafe_key,
+        guesses] shared by the threads, starting at index turn, and
+        replaces finished games with waiting ones."""
+        api = self.api_module
+        options = self.options
+        while True:
+            with self.lock:
+                if not active:
+                    return
+                game = active[turn % len(active)]
+                turn += 1
+            urlsafe_key, guesses = game
+            self.call('get_game', api.GET_GAME_REQUEST,
+                      urlsafe_game_key=urlsafe_key)
+            hint = None
+            if options.strategy == 'hint':
+                hint = self.call('get_hint', api.GET_GAME_REQUEST,
+                                 urlsafe_game_key=urlsafe_key)
+            with self.lock:
+                if game not in active or not guesses:
+                    continue
+                if hint is not None and hint.letter in guesses:
+                    guess = hint.letter
+                    guesses.remove(guess)
+                else:
+                    guess = guesses.pop(0)
+            form = self.call('make_move', api.MAKE_MOVE_REQUEST,
+                             urlsafe_game_key=urlsafe_key, guess=guess)
+            with self.lock:
+                if form is None and self.conflicted():
+                    # Another thread moved first; the guess is tried again.
+                    guesses.insert(0, guess)
+                    continue
+                if game not in active or not (
+                        form is None or form.game_over or not guesses):
+                    continue
+                active.remove(game)
+                if waiting:
+                    active.append(waiting.pop(0))
+            self.call('get_game_history', api.GET_GAME_REQUEST,
+                      urlsafe_game_key=urlsafe_key)
+
+    def read(self, worker):
+        """Runs this thread's share of the rounds of leaderboard and list
+        reads."""
+        api = self.api_module
+        options = self.options
+        for _ in range(worker, options.reads, options.threads):
+            name = 'player{}'.format(self.random.randrange(options.users))
+            self.call('get_high_scores', api.HIGH_SCORES_REQUEST,
+                      number_of_results=options.page_size)
+            self.call('get_user_rankings', api.USER_RANKINGS_REQUEST,
+                      number_of_results=options.page_size)
+            self.call('get_user_rank', api.USER_RANK_REQUEST,
+                      user_name=name, number_of_neighbors=2)
+            self.call('get_user_scores', api.USER_LIST_REQUEST,
+                      user_name=name, page_size=options.page_size)
+            self.call('get_user_games', api.USER_LIST_REQUEST,
+                      user_name=name, page_size=options.page_size)
+            self.call('get_average_misses', VoidRequest())
+
+    def report(self):
+        return {
+            'options': vars(self.options),
+            'wall_time': self.wall_time,
+            'endpoints': dict((name, stats.report())
+                              for name, stats in self.stats.iteritems()),
+        }
+
+
+def _elapsed_ms(start):
+    return 1000 * (time.time() - start)
+
+
+def startup_child(options):
+    """Measures the start of a fresh process as an instance would see it
+    and prints the timings as JSON. With --startup-child warm, the
+    /_ah/warmup work runs before the first requests."""
+    timings = {}
+    start = time.time()
+    import main
+    timings['import_main_ms'] = _elapsed_ms(start)
+    # Task and cron handlers should not load the Endpoints stack.
+    timings['main_loads_endpoints'] = 'endpoints' in sys.modules
+    benchmark = Benchmark(options)
+    benchmark.setup_stubs()
+    try:
+        if options.startup_child == 'warm':
+            start = time.time()
+            timings['warmup_steps_ms'] = dict(main.warmup.warm_up())
+            timings['warmup_ms'] = _elapsed_ms(start)
+        # The first API request on an instance imports the API module.
+        start = time.time()
+        import api
+        benchmark.api_module = api
+        benchmark.api = api.HangmanApi()
+        benchmark.call('create_user', api.USER_REQUEST, user_name='player0')
+        timings['first_create_user_ms'] = _elapsed_ms(start)
+        start = time.time()
+        benchmark.call('new_game', api.NEW_GAME_REQUEST,
+                       user_name='player0',
+                       allowed_misses=options.allowed_misses)
+        timings['first_new_game_ms'] = _elapsed_ms(start)
+    finally:
+        benchmark.teardown()
+    print(json.dumps(timings))
+
+
+def startup(options):
+    """Starts options.startup cold and warmed up processes and returns a
+    report of the median and worst of each timing."""
+    runs = {'cold': [], 'warm': []}
+    for _ in range(options.startup):
+        for mode in ('cold', 'warm'):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--startup-child', mode, '--root-path', options.root_path,
+                 '--allowed-misses', str(options.allowed_misses)])
+            runs[mode].append(json.loads(output.splitlines()[-1]))
+    report = {}
+    for mode, timings in runs.iteritems():
+        report[mode] = {}
+        for metric in timings[0]:
+            values = [timing[metric] for timing in timings]
+            if metric.endswith('_ms'):
+                report[mode][metric] = {'p50': percentile(values, 0.5),
+                                        'max': max(values)}
+            elif not isinstance(values[0], dict):
+                report[mode][metric] = any(values)
+    return {'options': vars(options), 'startup': report}
+
+
+class VoidRequest(object):
+    """Request container for endpoints that take no request fields."""
+
+    @property
+    def combined_message_class(self):
+        from protorpc import message_types
+        return message_types.VoidMessage
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--games-per-user', type=int, default=3)
+    parser.add_argument('--concurrent-games', type=int, default=25)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='threads playing the games and making reads '
+                        'at once')
+    parser.add_argument('--allowed-misses', type=int, default=6)
+    parser.add_argument('--strategy', default='frequency',
+                        choices=['frequency', 'random', 'hint'])
+    parser.add_argument('--reads', type=int, default=50,
+                        help='rounds of leaderboard and list reads')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--root-path', default='.',
+                        help='directory containing queue.yaml, if any')
+    parser.add_argument('--startup', type=int, default=0,
+                        help='measure this many cold and warmed up process '
+                        'starts instead of running the load test')
+    parser.add_argument('--startup-child', choices=['cold', 'warm'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='file to write the JSON report to')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv if argv is not None else sys.argv[1:])
+    random.seed(options.seed)
+    if options.startup_child:
+        startup_child(options)
+        return
+    if options.startup:
+        report = startup(options)
+    else:
+        benchmark = Benchmark(options)
+        benchmark.setup()
+        try:
+            benchmark.run()
+        finally:
+            benchmark.teardown()
+        report = benchmark.report()
+    report = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""counters.py - Sharded counters for running totals.
+
+Each named counter is split over NUM_SHARDS entities so increments from
+many requests do not contend on one entity group. Totals are cached in
+memcache and kept current with incr/decr, so reads normally cost a
+single memcache call. The *_async variants return ndb futures so
+callers can overlap counter RPCs with their own."""
+
+import random
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+MEMCACHE_COUNTER = 'COUNTER {}'
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter, keyed by '<name>-<index>'."""
+    count = ndb.IntegerProperty(required=True, default=0, indexed=False)
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '{}-{}'.format(name, index))
+            for index in range(NUM_SHARDS)]
+
+
+@ndb.tasklet
+def _sum_shards_async(name):
+    shards = yield ndb.get_multi_async(_shard_keys(name))
+    raise ndb.Return(sum(shard.count for shard in shards if shard))
+
+
+@ndb.tasklet
+def get_counts_async(names):
+    """Returns a future for a dict of the totals of the named counters.
+    Counters missing from memcache are summed from their shards
+    concurrently."""
+    context = ndb.get_context()
+    cached = yield [context.memcache_get(MEMCACHE_COUNTER.format(name))
+                    for name in names]
+    counts = dict((name, value) for name, value in zip(names, cached)
+                  if value is not None)
+    missing = [name for name in names if name not in counts]
+    if missing:
+        totals = yield [_sum_shards_async(name) for name in missing]
+        counts.update(zip(missing, totals))
+        yield [context.memcache_add(MEMCACHE_COUNTER.format(name), total)
+               for name, total in zip(missing, totals)]
+    raise ndb.Return(counts)
+
+
+def get_counts(names):
+    """Returns a dict of the totals of the named counters."""
+    return get_counts_async(names).get_result()
+
+
+@ndb.tasklet
+def increment_async(name, delta=1):
+    """Adds delta (which may be negative) to the named counter."""
+    if not delta:
+        return
+    key = random.choice(_shard_keys(name))
+
+    @ndb.tasklet
+    def _increment():
+        shard = yield key.get_async()
+        shard = shard or CounterShard(key=key)
+        shard.count += delta
+        yield shard.put_async()
+    yield ndb.transaction_async(_increment)
+    # Only adjusts the cached total if there is one; a missing total is
+    # rebuilt from the shards on the next read.
+    context = ndb.get_context()
+    if delta > 0:
+        yield context.memcache_incr(MEMCACHE_COUNTER.format(name), delta)
+    else:
+        yield context.memcache_decr(MEMCACHE_COUNTER.format(name), -delta)
+
+
+def increment(name, delta=1):
+    """Adds delta (which may be negative) to the named counter."""
+    increment_async(name, delta).get_result()
+
+
+def names_with_prefix(prefix):
+    """Returns the set of names of the counters starting with prefix that
+    have shards, read with a keys-only query."""
+    keys = CounterShard.query(
+        CounterShard.key >= ndb.Key(CounterShard, prefix),
+        CounterShard.key < ndb.Key(CounterShard, prefix + u'\ufffd')).fetch(
+            keys_only=True)
+    return set(key.id().rsplit('-', 1)[0] for key in keys)
+
+
+def set_count(name, value):
+    """Replaces the total of the named counter with value. Increments made
+    while this runs may be lost, so it is meant for reconcile jobs."""
+    keys = _shard_keys(name)
+    shards = [CounterShard(key=keys[0], count=value)]
+    shards.extend(CounterShard(key=key, count=0) for key in keys[1:])
+    ndb.put_multi(shards)
+    memcache.set(MEMCACHE_COUNTER.format(name), value)
@@ -0,0 +1,140 @@
+"""engine.py - Hangman game state engine.
+
+Guessed letters are tracked as a 26-bit mask and every secret word gets a
+precomputed letter -> positions map, so duplicate detection, hit/miss
+checks and reveals are constant time. The engine has no datastore
+dependencies so it can be used by the API and by offline simulations."""
+
+import string
+
+HIT = 'hit'
+MISS = 'miss'
+REPEAT = 'repeat'
+REPEAT_MESSAGE = 'That letter was already guessed. Try a different letter!'
+
+LETTER_BITS = dict((letter, 1 << index)
+                   for index, letter in enumerate(string.ascii_lowercase))
+# Number of secret words whose positions map is kept in memory.
+PLAN_CACHE_SIZE = 4096
+
+_plans = {}
+
+
+def is_letter(letter):
+    """Returns True if letter is a single lowercase letter from a to z."""
+    return letter in LETTER_BITS
+
+
+def letters_mask(letters):
+    """Returns the mask with a bit set for each letter in letters."""
+    mask = 0
+    for letter in letters:
+        mask |= LETTER_BITS.get(letter, 0)
+    return mask
+
+
+def word_plan(secret_word):
+    """Returns (positions, word_mask) for secret_word, where positions maps
+    each letter to the tuple of indexes it appears at."""
+    plan = _plans.get(secret_word)
+    if plan is None:
+        positions = {}
+        for index, letter in enumerate(secret_word):
+            positions.setdefault(letter, []).append(index)
+        positions = dict((letter, tuple(indexes))
+                         for letter, indexes in positions.iteritems())
+        plan = (positions, letters_mask(positions))
+        if len(_plans) >= PLAN_CACHE_SIZE:
+            _plans.clear()
+        _plans[secret_word] = plan
+    return plan
+
+
+class GameEngine(object):
+    """State of a single game of Hangman."""
+    __slots__ = ('secret_word', 'positions', 'word_mask', 'guessed_mask',
+                 'misses_left', 'missed_letters')
+
+    def __init__(self, secret_word, misses_left, guessed_mask=0,
+                 missed_letters=''):
+        self.secret_word = secret_word
+        self.positions, self.word_mask = word_plan(secret_word)
+        self.guessed_mask = guessed_mask
+        self.misses_left = misses_left
+        self.missed_letters = missed_letters
+
+    def guess(self, letter):
+        """Applies a guess and returns HIT, MISS or REPEAT.
+        Raises:
+            ValueError: if letter is not a lowercase letter from a to z."""
+        bit = LETTER_BITS.get(letter)
+        if bit is None:
+            raise ValueError('Non-alphabetic character entered!')
+        if self.guessed_mask & bit:
+            return REPEAT
+        self.guessed_mask |= bit
+        if bit & self.word_mask:
+            return HIT
+        self.misses_left -= 1
+        self.missed_letters += letter
+        return MISS
+
+    @property
+    def won(self):
+        """True once every letter of the secret word was guessed."""
+        return not self.word_mask & ~self.guessed_mask
+
+    @property
+    def lost(self):
+        """True once no misses are left."""
+        return self.misses_left < 1
+
+    @property
+    def over(self):
+        return self.won or self.lost
+
+    @property
+    def guessed_word(self):
+        """The secret word with dashes for letters not guessed yet."""
+        word = ['-'] * len(self.secret_word)
+        for letter, indexes in self.positions.iteritems():
+            if self.guessed_mask & LETTER_BITS.get(letter, 0):
+                for index in indexes:
+                    word[index] = letter
+        return ''.join(word)
+
+
+def result_message(result, engine):
+    """Returns the message shown for a HIT or MISS that led to the state
+    of engine."""
+    if result == HIT:
+        message = 'Guessed letter is in secret word!'
+        # The game is won once the user guessed the full secret word
+        if engine.won:
+            message += ' You win! The secret word is %s.' % engine.secret_word
+    else:
+        message = 'Guessed letter not in secret word!'
+    if engine.lost:
+        message += ' You lost! The secret word was %s.' % engine.secret_word
+    return message
+
+
+def encode_move(letter, result):
+    """Returns the history encoding of a move: the guessed letter in
+    uppercase for a hit and in lowercase for a miss."""
+    return letter.upper() if result == HIT else letter
+
+
+def decode_moves(moves):
+    """Yields (letter, hit) for each move in an encoded history."""
+    for move in moves:
+        yield move.lower(), move.isupper()
+
+
+def replay(secret_word, allowed_misses, moves):
+    """Yields (guess, message, guessed_word) for each turn of an encoded
+    history, rebuilding the messages and word snapshots."""
+    engine = GameEngine(secret_word, allowed_misses)
+    for letter, _ in decode_moves(moves):
+        result = engine.guess(letter)
+        yield letter, result_message(result, engine), engine.guessed_word
@@ -0,0 +1,131 @@
+"""game_cache.py - Write-through memcache cache of game state.
+
+Each Game is cached under its key as a dict of its properties, which
+includes the rendered form fields (guessed_word, missed_letters and the
+resolved user_name), so get_game is answered without the datastore.
+Moves claim the new state with compare-and-set before writing it to the
+datastore, so of two concurrent moves on one game only one succeeds, and
+the move is then written onto the stored game in a transaction that
+checks it is still the game the cached state was read from. Everything
+else that writes or deletes a Game evicts it from the cache first.
+Hits and misses are counted in-process and added to memcache counters at
+most every STATS_FLUSH_INTERVAL seconds, or when the instrumentation
+statistics are flushed, so reads make no extra memcache call for them."""
+
+import threading
+import time
+from google.appengine.api import memcache
+
+from models import Game, resolve_user_names
+from utils import get_by_urlsafe_async, key_from_urlsafe
+
+MEMCACHE_GAME = 'GAME {}'
+MEMCACHE_HITS = 'GAME CACHE HITS'
+MEMCACHE_MISSES = 'GAME CACHE MISSES'
+# Seconds between flushes of the in-process hit and miss counts.
+STATS_FLUSH_INTERVAL = 10
+
+_stats_lock = threading.Lock()
+_pending = {MEMCACHE_HITS: 0, MEMCACHE_MISSES: 0}
+_flushed = {'at': time.time()}
+
+
+def _state(game):
+    game.convert_turn_history()
+    return game.to_dict(exclude=['turn_history'])
+
+
+def _count(stat):
+    with _stats_lock:
+        _pending[stat] += 1
+        if time.time() - _flushed['at'] < STATS_FLUSH_INTERVAL:
+            return
+    flush_stats()
+
+
+def flush_stats():
+    """Adds the in-process hit and miss counts to the memcache counters."""
+    with _stats_lock:
+        deltas = dict((stat, count) for stat, count in _pending.iteritems()
+                      if count)
+        for stat in _pending:
+            _pending[stat] = 0
+        _flushed['at'] = time.time()
+    if deltas:
+        memcache.offset_multi(deltas, initial_value=0)
+
+
+def stats():
+    """Returns a dict with the numbers of cache hits and misses flushed
+    to memcache."""
+    counts = memcache.get_multi([MEMCACHE_HITS, MEMCACHE_MISSES])
+    return {'hits': counts.get(MEMCACHE_HITS, 0),
+            'misses': counts.get(MEMCACHE_MISSES, 0)}
+
+
+def store(game):
+    """Caches the state of game unconditionally."""
+    memcache.set(MEMCACHE_GAME.format(game.key.urlsafe()), _state(game))
+
+
+def store_multi(games):
+    """Caches the states of games unconditionally with one call."""
+    memcache.set_multi(dict((MEMCACHE_GAME.format(game.key.urlsafe()),
+                             _state(game)) for game in games))
+
+
+def delete(game_key):
+    """Removes a game from the cache."""
+    memcache.delete(MEMCACHE_GAME.format(game_key.urlsafe()))
+
+
+def delete_multi(game_keys):
+    """Removes games from the cache with one call."""
+    memcache.delete_multi([MEMCACHE_GAME.format(key.urlsafe())
+                           for key in game_keys])
+
+
+class GameCache(object):
+    """Reads games through the cache and writes them back with
+    compare-and-set. Use one instance per request."""
+
+    def __init__(self):
+        self.client = memcache.Client()
+        # Cache keys read with a compare-and-set id.
+        self._read = set()
+
+    def _gets(self, cache_key):
+        state = self.client.gets(cache_key)
+        if state is not None:
+            self._read.add(cache_key)
+        return state
+
+    def get(self, urlsafe):
+        """Returns the Game for a urlsafe key, or None. Raises
+        BadRequestException for a malformed key."""
+        key = key_from_urlsafe(urlsafe)
+        cache_key = MEMCACHE_GAME.format(key.urlsafe())
+        state = self._gets(cache_key)
+        if state is not None:
+            _count(MEMCACHE_HITS)
+            return Game(key=key, **state)
+        _count(MEMCACHE_MISSES)
+        game = get_by_urlsafe_async(urlsafe, Game).get_result()
+        if not game:
+            return None
+        resolve_user_names([game])
+        self.client.add(cache_key, _state(game))
+        # Read it back so a later claim has a compare-and-set id. Another
+        # request may have added the game first, and its state wins.
+        state = self._gets(cache_key)
+        return Game(key=key, **state) if state is not None else game
+
+    def claim(self, game):
+        """Stores the state of game if the cached copy did not change
+        since this cache read it. Returns False if another request changed
+        it first."""
+        cache_key = MEMCACHE_GAME.format(game.key.urlsafe())
+        if cache_key not in self._read:
+            # Memcache was unavailable when the game was read.
+            return True
+        return self.client.cas(cache_key, _state(game))
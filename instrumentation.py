@@ -0,0 +1,217 @@
+"""instrumentation.py - Per-endpoint call, latency and RPC statistics.
+
+Endpoint methods wrapped with @instrumented record their calls, errors,
+wall time histogram and the API calls they make, which are counted by an
+apiproxy pre-call hook. Statistics are collected in-process and added to
+memcache counters every FLUSH_INTERVAL seconds, spread over STATS_SHARDS
+key sets so instances do not contend on the same keys. Recording is off
+until enabled at runtime with set_enabled, and the switch is re-read from
+memcache at most every SWITCH_TTL seconds."""
+
+import functools
+import random
+import threading
+import time
+from collections import defaultdict
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+import game_cache
+
+MEMCACHE_ENABLED = 'INSTRUMENTATION ENABLED'
+MEMCACHE_GENERATION = 'INSTRUMENTATION GENERATION'
+MEMCACHE_ENDPOINTS = 'INSTRUMENTATION ENDPOINTS {}'
+MEMCACHE_STATS = 'STATS {} {}:'
+STATS_SHARDS = 10
+CAS_RETRIES = 3
+# Seconds between flushes of the in-process statistics to memcache.
+FLUSH_INTERVAL = 10
+# Seconds the runtime switch is cached in-process.
+SWITCH_TTL = 30
+# Upper bounds in milliseconds of the wall time histogram buckets.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_switch = {'enabled': False, 'expires': 0}
+_lock = threading.Lock()
+_pending = defaultdict(int)
+_flushed = {'at': time.time()}
+# RPC counts of the endpoint call in progress on this thread, if any.
+_current = threading.local()
+
+
+def _count_rpc(service, call, request, response):
+    rpcs = getattr(_current, 'rpcs', None)
+    if rpcs is not None:
+        rpcs['{}.{}'.format(service, call)] += 1
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _count_rpc)
+
+
+def is_enabled():
+    """Returns whether statistics are being recorded."""
+    now = time.time()
+    if now >= _switch['expires']:
+        _switch['enabled'] = bool(memcache.get(MEMCACHE_ENABLED))
+        _switch['expires'] = now + SWITCH_TTL
+    return _switch['enabled']
+
+
+def set_enabled(enabled):
+    """Turns recording on or off for all instances within SWITCH_TTL."""
+    memcache.set(MEMCACHE_ENABLED, bool(enabled))
+    _switch['enabled'] = bool(enabled)
+    _switch['expires'] = time.time() + SWITCH_TTL
+
+
+def _bucket(elapsed_ms):
+    for bound in LATENCY_BUCKETS:
+        if elapsed_ms < bound:
+            return 'lt_{}'.format(bound)
+    return 'ge_{}'.format(LATENCY_BUCKETS[-1])
+
+
+def _record(name, elapsed_ms, rpcs, failed):
+    with _lock:
+        _pending[(name, 'calls')] += 1
+        _pending[(name, 'errors')] += failed
+        _pending[(name, 'time_ms')] += int(elapsed_ms)
+        _pending[(name, _bucket(elapsed_ms))] += 1
+        for rpc, count in rpcs.iteritems():
+            _pending[(name, 'rpc:' + rpc)] += count
+        if time.time() - _flushed['at'] < FLUSH_INTERVAL:
+            return
+    flush()
+
+
+def _prefix(generation, shard):
+    return MEMCACHE_STATS.format(generation, shard)
+
+
+def flush():
+    """Adds the in-process statistics to a random shard of the memcache
+    counters, along with the game cache hit and miss counts."""
+    game_cache.flush_stats()
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed['at'] = time.time()
+    if not pending:
+        return
+    generation = memcache.get(MEMCACHE_GENERATION) or 0
+    deltas = dict(('{} {}'.format(name, metric), value)
+                  for (name, metric), value in pending.iteritems() if value)
+    memcache.offset_multi(
+        deltas, key_prefix=_prefix(generation,
+                                   random.randint(0, STATS_SHARDS - 1)),
+        initial_value=0)
+    rpcs = {}
+    for name, metric in pending:
+        metrics = rpcs.setdefault(name, set())
+        if metric.startswith('rpc:'):
+            metrics.add(metric)
+    _register(generation, rpcs)
+
+
+def _register(generation, rpcs):
+    """Adds endpoint names and the RPC metrics they recorded to the index
+    get_stats reads, a dict of endpoint name to RPC metric names."""
+    client = memcache.Client()
+    key = MEMCACHE_ENDPOINTS.format(generation)
+    for _ in range(CAS_RETRIES):
+        known = client.gets(key)
+        if known is None:
+            if client.add(key, dict((name, sorted(metrics))
+                                    for name, metrics in rpcs.iteritems())):
+                return
+            continue
+        if all(metrics.issubset(known.get(name, ()))
+               for name, metrics in rpcs.iteritems()):
+            return
+        known = dict(known)
+        for name, metrics in rpcs.iteritems():
+            known[name] = sorted(metrics.union(known.get(name, ())))
+        if client.cas(key, known):
+            return
+
+
+def instrumented(method):
+    """Decorates an endpoint method to record its statistics. Apply it
+    below @endpoints.method."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        if not is_enabled():
+            return method(self, request)
+        _current.rpcs = defaultdict(int)
+        failed = 1
+        start = time.time()
+        try:
+            response = method(self, request)
+            failed = 0
+            return response
+        finally:
+            elapsed_ms = 1000 * (time.time() - start)
+            rpcs = _current.rpcs
+            _current.rpcs = None
+            _record(name, elapsed_ms, rpcs, failed)
+    return wrapper
+
+
+def _fixed_metrics():
+    return (['calls', 'errors', 'time_ms'] +
+            ['lt_{}'.format(bound) for bound in LATENCY_BUCKETS] +
+            ['ge_{}'.format(LATENCY_BUCKETS[-1])])
+
+
+def get_stats():
+    """Returns a dict of statistics by endpoint name, summed over the
+    shards. Each has calls, errors, mean_ms, a latency histogram and the
+    RPC counts per call by service and method."""
+    generation = memcache.get(MEMCACHE_GENERATION) or 0
+    endpoints = memcache.get(MEMCACHE_ENDPOINTS.format(generation)) or {}
+    keys = ['{} {}'.format(name, metric)
+            for name, rpcs in endpoints.iteritems()
+            for metric in _fixed_metrics() + list(rpcs)]
+    prefixes = [_prefix(generation, shard) for shard in range(STATS_SHARDS)]
+    values = memcache.get_multi([prefix + key for prefix in prefixes
+                                 for key in keys])
+    totals = defaultdict(int)
+    for key, value in values.iteritems():
+        totals[key.split(':', 1)[1]] += int(value)
+    stats = {}
+    for name, rpcs in endpoints.iteritems():
+        def total(metric):
+            return totals['{} {}'.format(name, metric)]
+        calls = total('calls')
+        stats[name] = {
+            'calls': calls,
+            'errors': total('errors'),
+            'mean_ms': float(total('time_ms')) / calls if calls else None,
+            'latency_ms': dict((metric, total(metric))
+                               for metric in _fixed_metrics()[3:]
+                               if total(metric)),
+            'rpcs_per_call': dict((metric[len('rpc:'):],
+                                   float(total(metric)) / calls)
+                                  for metric in rpcs if calls),
+        }
+    return stats
+
+
+def reset():
+    """Discards the recorded statistics by starting a new generation of
+    counters; memcache evicts the old ones."""
+    with _lock:
+        _pending.clear()
+    memcache.incr(MEMCACHE_GENERATION, initial_value=0)
+
+
+def report():
+    """Returns a dict of the switch state, the endpoint statistics and the
+    game cache hit and miss counts."""
+    game_cache.flush_stats()
+    return {'enabled': is_enabled(),
+            'endpoints': get_stats(),
+            'game_cache': game_cache.stats()}
@@ -0,0 +1,153 @@
+"""leaderboard.py - Materialized top K high score leaderboard.
+
+The best TOP_K won Scores are kept in memcache, with a short-lived
+in-process copy used when memcache misses. A win that qualifies is
+inserted with compare-and-set when its game ends, and the leaderboard is
+rebuilt from the datastore whenever it is missing. Pages beyond the
+cached window are read from the datastore with a query cursor."""
+
+import time
+from google.appengine.api import datastore_errors, memcache
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Score, ScoreForm, resolve_user_names
+from utils import bad_request, cursor_from_urlsafe
+
+TOP_K = 100
+MEMCACHE_LEADERBOARD = 'LEADERBOARD'
+# Seconds the in-process copy may be served when memcache misses.
+LOCAL_TTL = 30
+CAS_RETRIES = 3
+# Prefix of cursors that point into the cached window.
+WINDOW_CURSOR = 'top:'
+
+_local = {'board': None, 'expires': 0}
+
+
+def _query():
+    """High scores are sorted by least amount of misses. A tiebreaker is
+    word difficulty."""
+    return Score.query(Score.won == True).order(
+        Score.misses).order(-Score.difficulty)
+
+
+def _row(score):
+    return {'id': score.key.id(),
+            'user_name': score.user_name,
+            'date': str(score.date),
+            'misses': score.misses,
+            'difficulty': score.difficulty}
+
+
+def _sort_key(row):
+    # The datastore breaks ties between equal sort values by key.
+    return row['misses'], -row['difficulty'], row['id']
+
+
+def _to_form(row):
+    return ScoreForm(user_name=row['user_name'], date=row['date'], won=True,
+                     misses=row['misses'], difficulty=row['difficulty'])
+
+
+def _store_local(board):
+    _local['board'] = board
+    _local['expires'] = time.time() + LOCAL_TTL
+
+
+def rebuild():
+    """Rebuilds the leaderboard from the datastore and returns it."""
+    scores, cursor, more = _query().fetch_page(TOP_K)
+    resolve_user_names(scores)
+    board = {'rows': [_row(score) for score in scores],
+             'more': more,
+             'cursor': cursor.urlsafe() if more and cursor else None}
+    memcache.set(MEMCACHE_LEADERBOARD, board)
+    _store_local(board)
+    return board
+
+
+def get_board():
+    """Returns the leaderboard, rebuilding it if it is not cached."""
+    board = memcache.get(MEMCACHE_LEADERBOARD)
+    if board is not None:
+        _store_local(board)
+        return board
+    if _local['board'] is not None and time.time() < _local['expires']:
+        return _local['board']
+    return rebuild()
+
+
+def record_win(score):
+    """Inserts a won Score into the cached leaderboard if it qualifies."""
+    row = _row(score)
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        board = client.gets(MEMCACHE_LEADERBOARD)
+        if board is None:
+            # Rebuilt with the new score on the next read.
+            return
+        rows = board['rows']
+        if any(other['id'] == row['id'] for other in rows):
+            # A rebuild since the Score was saved already included it.
+            return
+        if board['more'] and rows and _sort_key(row) >= _sort_key(rows[-1]):
+            return
+        rows.append(row)
+        rows.sort(key=_sort_key)
+        if len(rows) > TOP_K:
+            del rows[TOP_K:]
+            # The saved cursor is now past a row that left the window, so
+            # it is recomputed the next time a page beyond it is requested.
+            board['more'] = True
+            board['cursor'] = None
+        if client.cas(MEMCACHE_LEADERBOARD, board):
+            _store_local(board)
+            return
+    # Too much contention; let the next read rebuild it.
+    memcache.delete(MEMCACHE_LEADERBOARD)
+
+
+def _window_offset(cursor):
+    """Returns the offset into the cached window of a window cursor.
+    Raises BadRequestException if it is malformed."""
+    try:
+        offset = int(cursor[len(WINDOW_CURSOR):])
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise bad_request('Invalid cursor')
+    return offset
+
+
+def get_page(number, cursor=None):
+    """Returns (ScoreForms items, next cursor) for a page of up to number
+    high scores starting at cursor. Raises BadRequestException for a
+    malformed cursor."""
+    if cursor and not cursor.startswith(WINDOW_CURSOR):
+        try:
+            scores, next_cursor, more = _query().fetch_page(
+                number, start_cursor=cursor_from_urlsafe(cursor))
+        except datastore_errors.BadRequestError:
+            # The cursor is of another query.
+            raise bad_request('Invalid cursor')
+        return (Score.to_forms(scores),
+                next_cursor.urlsafe() if more and next_cursor else None)
+    offset = _window_offset(cursor) if cursor else 0
+    board = get_board()
+    if board['more'] and board['cursor'] is None and \
+            offset + number >= len(board['rows']):
+        board = rebuild()
+    rows = board['rows'][offset:offset + number]
+    items = [_to_form(row) for row in rows]
+    end = offset + len(rows)
+    if end < len(board['rows']):
+        return items, WINDOW_CURSOR + str(end)
+    if not board['more']:
+        return items, None
+    if len(rows) == number:
+        return items, board['cursor']
+    # Continue past the cached window with the datastore.
+    scores, next_cursor, more = _query().fetch_page(
+        number - len(rows), start_cursor=Cursor(urlsafe=board['cursor']))
+    items.extend(Score.to_forms(scores))
+    return items, next_cursor.urlsafe() if more and next_cursor else None
@@ -3,44 +3,211 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 
+import json
+import logging
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import HangmanApi
+from datetime import timedelta
+from google.appengine.api import taskqueue
 
-from models import User, Game
+from models import Game, User
+import instrumentation
+import migrations
+import reminders
+import sweeper
+import warmup
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """Preload the word index, caches and API module of a new
+        instance."""
+        timings = warmup.warm_up()
+        logging.info('Warmed up in %.0f ms: %s', sum(timings.values()),
+                     ', '.join('{} {:.0f} ms'.format(name, ms)
+                               for name, ms in timings.iteritems()))
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
         """Send a reminder email to each User with an at least one
          active game. Called every hour using a cron job"""
-        app_id = app_identity.get_application_id()
-        # users = User.query(User.email != None)
-        games = Game.query(Game.game_over == False)
-        users_emailed = []
-        for game in games:
-            user = User.query(User.key == game.user).get()
-            if user.email and user.name not in users_emailed:
-                subject = 'Reminder: Time to play Hangman!'
-                body = 'Hello {}, you have at least one active game at' \
-                       'hangman-game-api.appspot.com! Time to take a ' \
-                       'turn!'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
-                users_emailed.append(user.name)
+        reminders.start()
+
+
+class ProcessReminderPage(webapp2.RequestHandler):
+    def post(self):
+        """Queue reminder emails for one page of users with active games
+        and enqueue the next page."""
+        reminders.process_page(self.request.get('run_id'),
+                               int(self.request.get('page')),
+                               self.request.get('cursor') or None,
+                               int(self.request.get('emailed')),
+                               float(self.request.get('started')))
+        self.response.set_status(204)
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+    def post(self):
+        """Send reminder emails to a batch of (name, email) pairs."""
+        reminders.send_batch(json.loads(self.request.body))
+        self.response.set_status(204)
 
 
 class UpdateAverageMissesRemaining(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing the active game counters. Called daily using
+        a cron job to correct any drift."""
+        self.post()
+
+    def post(self):
+        """Recompute one page of the active game counters and enqueue
+        the next."""
+        cursor, games, misses_left = Game.reconcile_active_counters(
+            self.request.get('cursor') or None,
+            int(self.request.get('games', 0)),
+            int(self.request.get('misses_left', 0)))
+        if cursor:
+            taskqueue.add(url='/tasks/cache_average_misses',
+                          params={'cursor': cursor, 'games': games,
+                                  'misses_left': misses_left})
+        self.response.set_status(204)
+
+
+class FoldUserStats(webapp2.RequestHandler):
+    def get(self):
+        """Start folding completed games onto Users. Called every 10
+        minutes using a cron job."""
+        self.post()
+
+    def post(self):
+        """Fold the stat shards of one page of Users and enqueue the
+        next."""
+        cursor, _ = User.fold_stats_page(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/fold_user_stats',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class ReconcileRankBuckets(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing the rank bucket counters and re-bucketing
+        Users. Called daily using a cron job to correct any drift."""
+        self.post()
+
+    def post(self):
+        """Recompute the rank counts of one page of Users and enqueue the
+        next."""
+        cursor, counts = User.reconcile_rank_buckets(
+            self.request.get('cursor') or None,
+            json.loads(self.request.get('counts') or '{}'))
+        if cursor:
+            taskqueue.add(url='/tasks/reconcile_rank_buckets',
+                          params={'cursor': cursor,
+                                  'counts': json.dumps(counts)})
+        self.response.set_status(204)
+
+
+class StartSweep(webapp2.RequestHandler):
+    def get(self):
+        """Start expiring idle games and archiving finished ones. Called
+        daily using a cron job; idle_days overrides the idle TTL."""
+        idle_days = self.request.get('idle_days')
+        if idle_days:
+            sweeper.start(timedelta(days=float(idle_days)))
+        else:
+            sweeper.start()
+
+
+class SweepPage(webapp2.RequestHandler):
+    def post(self):
+        """Sweep one page of games and enqueue the next."""
+        sweeper.process_page(self.request.get('run_id'),
+                             self.request.get('phase'),
+                             int(self.request.get('page')),
+                             self.request.get('cursor') or None,
+                             int(self.request.get('started')),
+                             int(self.request.get('idle_ttl')))
+        self.response.set_status(204)
+
+
+class MigrateTurnHistory(webapp2.RequestHandler):
+    def post(self):
+        """Convert one page of legacy turn histories and enqueue the next."""
+        migrations.migrate_turn_history(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class BackfillUserNames(webapp2.RequestHandler):
+    def post(self):
+        """Backfill user_name on one page of Games or Scores and enqueue
+        the next."""
+        migrations.backfill_user_names(self.request.get('kind', 'Game'),
+                                       self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateUserKeys(webapp2.RequestHandler):
+    def post(self):
+        """Re-key one page of Users by name and enqueue the next."""
+        migrations.migrate_user_keys(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateUserReferences(webapp2.RequestHandler):
+    def post(self):
+        """Point Games and Scores of a re-keyed User at its new key."""
+        migrations.migrate_user_references(self.request.get('old_key'),
+                                           self.request.get('new_key'))
+        self.response.set_status(204)
+
+
+class BackfillRankBuckets(webapp2.RequestHandler):
+    def post(self):
+        """Backfill rank buckets on one page of Users and enqueue the
+        next."""
+        migrations.backfill_rank_buckets(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class BackfillLastMove(webapp2.RequestHandler):
+    def post(self):
+        """Backfill last_move on one page of Games and enqueue the
+        next."""
+        migrations.backfill_last_move(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class EndpointStats(webapp2.RequestHandler):
+    def get(self):
+        """Return the recorded endpoint and game cache statistics."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.report()))
+
     def post(self):
-        """Update game listing announcement in memcache."""
-        HangmanApi._cache_average_misses()
+        """Turn recording on or off with enabled=1/0, and discard the
+        recorded statistics with reset=1."""
+        if self.request.get('enabled'):
+            instrumentation.set_enabled(self.request.get('enabled') == '1')
+        if self.request.get('reset') == '1':
+            instrumentation.reset()
         self.response.set_status(204)
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', Warmup),
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/reminders/page', ProcessReminderPage),
+    ('/tasks/reminders/send', SendReminderBatch),
     ('/tasks/cache_average_misses', UpdateAverageMissesRemaining),
+    ('/tasks/fold_user_stats', FoldUserStats),
+    ('/tasks/reconcile_rank_buckets', ReconcileRankBuckets),
+    ('/tasks/migrate/turn_history', MigrateTurnHistory),
+    ('/tasks/migrate/user_names', BackfillUserNames),
+    ('/tasks/migrate/user_keys', MigrateUserKeys),
+    ('/tasks/migrate/user_references', MigrateUserReferences),
+    ('/tasks/migrate/rank_buckets', BackfillRankBuckets),
+    ('/tasks/migrate/last_move', BackfillLastMove),
+    ('/crons/sweep', StartSweep),
+    ('/tasks/sweep', SweepPage),
+    ('/admin/stats', EndpointStats),
 ], debug=True)
@@ -0,0 +1,172 @@
+"""migrations.py - One-time data migrations run through the task queue.
+
+Each migration processes one cursor page of entities per task and then
+enqueues itself with the next cursor, so it can run over any number of
+entities and resumes from the last completed page if a task fails.
+Games are evicted from the game cache before they are written, so a move
+does not save a cached copy of the game from before the migration."""
+
+import logging
+from collections import Counter
+from datetime import datetime
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import counters
+import game_cache
+from models import Game, Score, User, resolve_user_names
+
+BATCH_SIZE = 100
+
+
+def _start_cursor(cursor):
+    """Returns the Cursor for a urlsafe cursor string, or None."""
+    return Cursor(urlsafe=cursor) if cursor else None
+
+
+def _next_page(url, cursor, more, **params):
+    """Enqueues the next page of a migration if there is one."""
+    if more and cursor:
+        params['cursor'] = cursor.urlsafe()
+        taskqueue.add(url=url, params=params)
+
+
+def migrate_turn_history(cursor=None, batch_size=BATCH_SIZE):
+    """Converts legacy pickled turn histories to the compact moves
+    encoding. Returns the number of games converted in this page."""
+    games, next_cursor, more = Game.query().fetch_page(
+        batch_size, start_cursor=_start_cursor(cursor))
+    # Game._pre_put_hook does the conversion.
+    legacy = [game for game in games if game.turn_history]
+    game_cache.delete_multi([game.key for game in legacy])
+    ndb.put_multi(legacy)
+    logging.info('Converted turn history of %d games', len(legacy))
+    _next_page('/tasks/migrate/turn_history', next_cursor, more)
+    return len(legacy)
+
+
+def backfill_user_names(kind, cursor=None, batch_size=BATCH_SIZE):
+    """Copies the User name onto Games or Scores (kind is 'Game' or
+    'Score') saved before user_name was added. Returns the number of
+    entities updated in this page."""
+    model = {'Game': Game, 'Score': Score}[kind]
+    entities, next_cursor, more = model.query().fetch_page(
+        batch_size, start_cursor=_start_cursor(cursor))
+    missing = [entity for entity in entities if not entity.user_name]
+    resolve_user_names(missing)
+    resolved = [entity for entity in missing if entity.user_name]
+    if kind == 'Game':
+        game_cache.delete_multi([game.key for game in resolved])
+    ndb.put_multi(resolved)
+    logging.info('Backfilled user_name on %d %s entities', len(missing), kind)
+    _next_page('/tasks/migrate/user_names', next_cursor, more, kind=kind)
+    return len(missing)
+
+
+def _copy_user_async(user):
+    """Copies a legacy User to its name-derived key in a transaction,
+    unless another User already has that key. Returns a future for the
+    copy, which may have been saved by an earlier run, or for None."""
+    key = User.key_for_name(user.name)
+
+    @ndb.tasklet
+    def _copy():
+        copy = yield key.get_async()
+        if copy is None:
+            copy = User(key=key, **user.to_dict())
+            copy.legacy_key = user.key
+            yield copy.put_async()
+        elif copy.legacy_key != user.key:
+            raise ndb.Return(None)
+        raise ndb.Return(copy)
+    return ndb.transaction_async(_copy)
+
+
+def migrate_user_keys(cursor=None, batch_size=BATCH_SIZE):
+    """Copies Users with numeric ids to name-derived keys and enqueues a
+    task per User to move its Games and Scores over. A User whose
+    name-derived key is taken by another User is left alone and logged.
+    Returns the number of Users copied in this page. Best run while
+    traffic is low."""
+    users, next_cursor, more = User.query().fetch_page(
+        batch_size, start_cursor=_start_cursor(cursor))
+    legacy = [user for user in users
+              if user.key != User.key_for_name(user.name)]
+    futures = [_copy_user_async(user) for user in legacy]
+    copied = 0
+    for user, future in zip(legacy, futures):
+        copy = future.get_result()
+        if copy is None:
+            logging.warning('Not re-keying User %s: the name %s is taken',
+                            user.key, user.name)
+            continue
+        copied += 1
+        User.uncache_key(user.name)
+        taskqueue.add(url='/tasks/migrate/user_references',
+                      params={'old_key': user.key.urlsafe(),
+                              'new_key': copy.key.urlsafe()})
+    logging.info('Re-keyed %d users', copied)
+    _next_page('/tasks/migrate/user_keys', next_cursor, more)
+    return copied
+
+
+def migrate_user_references(old_key, new_key, batch_size=BATCH_SIZE):
+    """Points a page of Games and Scores at a re-keyed User. Enqueues
+    itself until none are left, then folds the games still counted in the
+    old User's stat shards onto the new User and deletes the old User."""
+    old = ndb.Key(urlsafe=old_key)
+    new = ndb.Key(urlsafe=new_key)
+    entities = (Game.query(Game.user == old).fetch(batch_size) +
+                Score.query(Score.user == old).fetch(batch_size))
+    for entity in entities:
+        entity.user = new
+    game_cache.delete_multi([entity.key for entity in entities
+                             if isinstance(entity, Game)])
+    ndb.put_multi(entities)
+    if entities:
+        taskqueue.add(url='/tasks/migrate/user_references',
+                      params={'old_key': old_key, 'new_key': new_key})
+    else:
+        User.fold_stats_async(old).get_result()
+        old.delete()
+    return len(entities)
+
+
+def backfill_rank_buckets(cursor=None, batch_size=BATCH_SIZE):
+    """Sets rank_group and rank_bucket on ranked Users saved before they
+    were added and counts them in the rank group and bucket counters.
+    Returns the number of Users updated in this page."""
+    # A != None filter would run as two queries, which cannot be paged.
+    users, next_cursor, more = User.query(User.win_ratio >= 0).fetch_page(
+        batch_size, start_cursor=_start_cursor(cursor))
+    missing = [user for user in users if user.rank_group is None]
+    for user in missing:
+        user.rank_group = User.group_for(user.win_ratio)
+        user.rank_bucket = User.bucket_for(user.avg_misses)
+    ndb.put_multi(missing)
+    for name, count in Counter(
+            name for user in missing
+            for name in User.rank_counter_names(
+                *user.rank_position())).iteritems():
+        counters.increment(name, count)
+    logging.info('Backfilled rank buckets on %d users', len(missing))
+    _next_page('/tasks/migrate/rank_buckets', next_cursor, more)
+    return len(missing)
+
+
+def backfill_last_move(cursor=None, batch_size=BATCH_SIZE):
+    """Sets last_move to now on Games saved before it was added, so the
+    sweeper expires or archives them a full idle period from now. Returns
+    the number of Games updated in this page."""
+    games, next_cursor, more = Game.query().fetch_page(
+        batch_size, start_cursor=_start_cursor(cursor))
+    missing = [game for game in games if game.last_move is None]
+    now = datetime.now()
+    for game in missing:
+        game.last_move = now
+    game_cache.delete_multi([game.key for game in missing])
+    ndb.put_multi(missing)
+    logging.info('Backfilled last_move on %d games', len(missing))
+    _next_page('/tasks/migrate/last_move', next_cursor, more)
+    return len(missing)
@@ -1,12 +1,43 @@
-import csv
+import logging
 import random
-from datetime import date
+from collections import OrderedDict
+from datetime import date, datetime
 from protorpc import messages
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+import counters
+from engine import (GameEngine, HIT, MISS, encode_move, letters_mask,
+                    replay)
+from utils import LRUCache
+from word_index import get_word_index, word_difficulty
+
+MEMCACHE_USER_KEY = 'USER KEY {}'
+# Per-instance cache of user name -> key of Users not keyed by name yet.
+_user_keys = LRUCache(4096)
+# Names of the counters of active games and their total misses left.
+ACTIVE_GAMES = 'active_games'
+ACTIVE_MISSES_LEFT = 'active_misses_left'
+# Ranked Users are counted by their place in the rank order. win_ratio is
+# split into RANK_GROUPS + 1 rank groups, each with a counter of its
+# Users. Users with the same win_ratio are split into MISS_BUCKETS rank
+# buckets of avg_misses MISS_BUCKET_WIDTH wide, each with a counter named
+# by the win_ratio and bucket.
+RANK_GROUPS = 100
+MISS_BUCKETS = 20
+MISS_BUCKET_WIDTH = 0.5
+RANK_GROUP_COUNTER = 'rank_group_{}'
+RANK_BUCKET_PREFIX = 'rank_bucket_'
+RANK_BUCKET_COUNTER = RANK_BUCKET_PREFIX + '{!r}_{}'
+# Completed games are counted in one of USER_STAT_SHARDS stat shards of
+# their User and folded onto the User by a cron job.
+USER_STAT_SHARDS = 5
+
 
 class User(ndb.Model):
-    """User Profile"""
+    """User Profile. Users are keyed by name; Users created before that
+    have numeric ids until /tasks/migrate/user_keys re-keys them."""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
     wins = ndb.IntegerProperty(required=True, default=0)
@@ -16,6 +47,330 @@ class User(ndb.Model):
     avg_won_difficulty = ndb.FloatProperty()
     misses = ndb.IntegerProperty(required=True, default=0)
     avg_misses = ndb.FloatProperty()
+    # rank_group is the rank group of win_ratio (see group_for) and
+    # rank_bucket the rank bucket of avg_misses (see bucket_for), both
+    # higher for better ranked Users and None until the User completes a
+    # game.
+    rank_group = ndb.IntegerProperty()
+    rank_bucket = ndb.IntegerProperty()
+    # legacy_key is the numeric-id key of the User this one was copied
+    # from by /tasks/migrate/user_keys, if any.
+    legacy_key = ndb.KeyProperty(kind='User', indexed=False)
+
+    @classmethod
+    def key_for_name(cls, name):
+        """Returns the name-derived key for a User."""
+        return ndb.Key(cls, name)
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, name):
+        """Returns a future for the User with the given name, or None. The
+        name-derived key is read first. Users that are not keyed by name
+        yet are found by their key, read through an in-process LRU cache
+        and memcache, and otherwise by a query on name."""
+        if not name:
+            raise ndb.Return(None)
+        user = yield cls.key_for_name(name).get_async()
+        if user is not None:
+            raise ndb.Return(user)
+        key = _user_keys.get(name)
+        if key is None:
+            urlsafe = yield ndb.get_context().memcache_get(
+                MEMCACHE_USER_KEY.format(name))
+            if urlsafe:
+                key = ndb.Key(urlsafe=urlsafe)
+                _user_keys.set(name, key)
+        user = (yield key.get_async()) if key else None
+        if user is None:
+            user = yield cls.query(cls.name == name).get_async()
+            if user is not None:
+                yield cls.cache_key_async(user)
+        raise ndb.Return(user)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with the given name, or None."""
+        return cls.get_by_name_async(name).get_result()
+
+    @staticmethod
+    def cache_key_async(user):
+        """Caches the key of a User not keyed by name under its name."""
+        _user_keys.set(user.name, user.key)
+        return ndb.get_context().memcache_set(
+            MEMCACHE_USER_KEY.format(user.name), user.key.urlsafe())
+
+    @staticmethod
+    def uncache_key(name):
+        """Removes the cached key for name."""
+        _user_keys.delete(name)
+        memcache.delete(MEMCACHE_USER_KEY.format(name))
+
+    @classmethod
+    @ndb.tasklet
+    def create_async(cls, name, email=None):
+        """Creates a User keyed by name. Returns a future for the User, or
+        for None if a User with that name already exists."""
+        # Users created before keying by name are only found by a query.
+        if (yield cls.query(cls.name == name).get_async(keys_only=True)):
+            raise ndb.Return(None)
+        key = cls.key_for_name(name)
+
+        @ndb.tasklet
+        def _create():
+            if (yield key.get_async()):
+                raise ndb.Return(None)
+            user = cls(key=key, name=name, email=email, wins=0,
+                       total_games=0, won_games_difficulty=0, misses=0)
+            yield user.put_async()
+            raise ndb.Return(user)
+        user = yield ndb.transaction_async(_create)
+        raise ndb.Return(user)
+
+    @classmethod
+    @ndb.tasklet
+    def create_multi_async(cls, users):
+        """Creates Users keyed by name from a list of (name, email) pairs.
+        Returns a future for (created, existing): the new Users and the
+        names that were already taken. Existence is checked with one
+        batched get, and the names it did not find with concurrent
+        queries for Users not yet keyed by name. The Users are saved with
+        one batched put, so unlike create_async this does not guard
+        against the same name being created concurrently."""
+        keys = [cls.key_for_name(name) for name, _ in users]
+        found = yield ndb.get_multi_async(keys)
+        missing = [name for (name, _), user in zip(users, found)
+                   if not user]
+        legacy = yield [cls.query(cls.name == name).get_async(keys_only=True)
+                        for name in missing]
+        taken = set(name for name, key in zip(missing, legacy) if key)
+        taken.update(user.name for user in found if user)
+        existing = [name for name, _ in users if name in taken]
+        created = [cls(key=key, name=name, email=email, wins=0,
+                       total_games=0, won_games_difficulty=0, misses=0)
+                   for key, (name, email) in zip(keys, users)
+                   if name not in taken]
+        yield ndb.put_multi_async(created)
+        raise ndb.Return(created, existing)
+
+    def add_stats(self, total_games, wins, misses, won_games_difficulty):
+        """Adds completed games to the data used for ranking users."""
+        self.total_games += total_games
+        self.wins += wins
+        self.misses += misses
+        self.won_games_difficulty += won_games_difficulty
+        if not self.total_games:
+            return
+        self.avg_misses = self.misses / float(self.total_games)
+        if self.wins:
+            self.avg_won_difficulty = \
+                self.won_games_difficulty / float(self.wins)
+        self.win_ratio = self.wins / float(self.total_games)
+        self.rank_group = User.group_for(self.win_ratio)
+        self.rank_bucket = User.bucket_for(self.avg_misses)
+
+    @staticmethod
+    def stat_shard_keys(user_key):
+        """Returns the keys of the stat shards of a User."""
+        return [ndb.Key(UserStatShard, '{}:{}'.format(user_key.urlsafe(),
+                                                      index))
+                for index in range(USER_STAT_SHARDS)]
+
+    @staticmethod
+    @ndb.tasklet
+    def record_game_async(user_key, won, misses, difficulty):
+        """Counts a completed game in a random stat shard of a User. Run
+        it in a transaction to count the game exactly once."""
+        key = random.choice(User.stat_shard_keys(user_key))
+        shard = yield key.get_async()
+        shard = shard or UserStatShard(key=key)
+        shard.add(won, misses, difficulty)
+        yield shard.put_async()
+
+    @staticmethod
+    @ndb.tasklet
+    def fold_stats_async(user_key):
+        """Moves the games counted in the stat shards of a User onto the
+        User and its rank bucket counter. The games of a legacy User
+        re-keyed by /tasks/migrate/user_keys are moved onto its copy under
+        the name-derived key, which replaces it. Returns a future for True
+        if any games were folded."""
+        @ndb.tasklet
+        def _fold():
+            user, shards = yield (user_key.get_async(),
+                                  ndb.get_multi_async(
+                                      User.stat_shard_keys(user_key)))
+            shards = [shard for shard in shards if shard and shard.dirty]
+            if not shards:
+                raise ndb.Return(None)
+            if user is None:
+                # The User was deleted; its games cannot be folded.
+                logging.warning('Dropping stat shards of missing User %s',
+                                user_key)
+                yield ndb.delete_multi_async([shard.key
+                                              for shard in shards])
+                raise ndb.Return(None)
+            if user.key != User.key_for_name(user.name):
+                copy = yield User.key_for_name(user.name).get_async()
+                if copy is not None and copy.legacy_key == user.key:
+                    user = copy
+            old_position = user.rank_position()
+            for shard in shards:
+                user.add_stats(shard.total_games, shard.wins, shard.misses,
+                               shard.won_games_difficulty)
+                shard.clear()
+            yield ndb.put_multi_async([user] + shards)
+            raise ndb.Return(old_position, user.rank_position())
+        # Games counted while the fold runs make it retry, so none are
+        # lost or counted twice.
+        positions = yield ndb.transaction_async(_fold, xg=True)
+        if positions is None:
+            raise ndb.Return(False)
+        yield User.count_rank_buckets_async(*positions)
+        raise ndb.Return(True)
+
+    @staticmethod
+    def fold_stats_page(cursor=None, page_size=100):
+        """Folds the stat shards of one page of Users with unfolded games.
+        Returns (cursor, folded); cursor is None after the last page."""
+        keys, next_cursor, more = \
+            UserStatShard.query(UserStatShard.dirty == True).fetch_page(
+                page_size, keys_only=True,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        user_keys = set(UserStatShard.user_key(key) for key in keys)
+        futures = [User.fold_stats_async(key) for key in user_keys]
+        folded = sum(1 for future in futures if future.get_result())
+        return (next_cursor.urlsafe() if more and next_cursor else None,
+                folded)
+
+    @staticmethod
+    def group_for(win_ratio):
+        """Returns the rank group of a win ratio. Higher win ratios have
+        higher or equal groups."""
+        return int(win_ratio * RANK_GROUPS)
+
+    @staticmethod
+    def bucket_for(avg_misses):
+        """Returns the rank bucket of an average number of misses. Fewer
+        average misses have higher or equal buckets."""
+        misses = min(int((avg_misses or 0) / MISS_BUCKET_WIDTH),
+                     MISS_BUCKETS - 1)
+        return MISS_BUCKETS - 1 - misses
+
+    def rank_position(self):
+        """Returns (win_ratio, rank_bucket) as counted in the rank
+        counters, or None if the User is not counted in them."""
+        if self.rank_group is None or self.rank_bucket is None:
+            return None
+        return self.win_ratio, self.rank_bucket
+
+    @staticmethod
+    def rank_counter_names(win_ratio, bucket):
+        """Returns the names of the rank group and rank bucket counters of
+        a User with win_ratio in rank bucket bucket."""
+        return (RANK_GROUP_COUNTER.format(User.group_for(win_ratio)),
+                RANK_BUCKET_COUNTER.format(win_ratio, bucket))
+
+    @staticmethod
+    @ndb.tasklet
+    def count_rank_buckets_async(old_position, new_position):
+        """Moves a User between rank group and rank bucket counters. The
+        positions are (win_ratio, rank_bucket) pairs; old_position is None
+        for a User entering the rankings."""
+        if old_position == new_position:
+            return
+        deltas = dict((name, 1)
+                      for name in User.rank_counter_names(*new_position))
+        if old_position is not None:
+            for name in User.rank_counter_names(*old_position):
+                deltas[name] = deltas.get(name, 0) - 1
+        yield [counters.increment_async(name, delta)
+               for name, delta in deltas.iteritems()]
+
+    @staticmethod
+    def _rank_group_names():
+        return [RANK_GROUP_COUNTER.format(group)
+                for group in range(RANK_GROUPS + 1)]
+
+    @staticmethod
+    @ndb.tasklet
+    def rank_group_counts_async():
+        """Returns a future for a list of the number of Users in each
+        rank group."""
+        names = User._rank_group_names()
+        counts = yield counters.get_counts_async(names)
+        raise ndb.Return([counts[name] for name in names])
+
+    @staticmethod
+    @ndb.tasklet
+    def rank_bucket_counts_async(win_ratio):
+        """Returns a future for a list of the number of Users with
+        win_ratio in each rank bucket."""
+        names = [RANK_BUCKET_COUNTER.format(win_ratio, bucket)
+                 for bucket in range(MISS_BUCKETS)]
+        counts = yield counters.get_counts_async(names)
+        raise ndb.Return([counts[name] for name in names])
+
+    def _stale_rank(self):
+        return (self.rank_group != User.group_for(self.win_ratio) or
+                self.rank_bucket != User.bucket_for(self.avg_misses))
+
+    @staticmethod
+    def _rebucket_async(key):
+        """Moves a User to the rank group and bucket of its current stats
+        in a transaction. Returns a future for its rank_position, or for
+        None if it is no longer ranked."""
+        @ndb.tasklet
+        def _rebucket():
+            user = yield key.get_async()
+            if user is None or user.win_ratio is None:
+                raise ndb.Return(None)
+            user.rank_group = User.group_for(user.win_ratio)
+            user.rank_bucket = User.bucket_for(user.avg_misses)
+            yield user.put_async()
+            raise ndb.Return(user.rank_position())
+        return ndb.transaction_async(_rebucket)
+
+    @staticmethod
+    def reconcile_rank_buckets(cursor=None, counts=None, page_size=500):
+        """Adds one page of ranked Users to counts, a dict of rank counter
+        name to number of Users, first moving Users whose rank group or
+        bucket does not match their stats. Returns (cursor, counts);
+        cursor is None once the last page was added and the rank counters
+        that differ from the recomputed totals were replaced."""
+        counts = dict(counts or {})
+        # All ranked Users; a != None filter runs as two queries, which
+        # cannot be paged.
+        users, next_cursor, more = \
+            User.query(User.win_ratio >= 0).fetch_page(
+                page_size,
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        positions = dict((user.key, user.rank_position()) for user in users)
+        stale = [user.key for user in users if user._stale_rank()]
+        futures = [User._rebucket_async(key) for key in stale]
+        for key, future in zip(stale, futures):
+            positions[key] = future.get_result()
+        for position in positions.itervalues():
+            if position is not None:
+                for name in User.rank_counter_names(*position):
+                    counts[name] = counts.get(name, 0) + 1
+        if more and next_cursor:
+            return next_cursor.urlsafe(), counts
+        User._replace_rank_counts(counts)
+        return None, counts
+
+    @staticmethod
+    def _replace_rank_counts(counts):
+        """Replaces the rank counters that differ from counts, including
+        rank bucket counters of win ratios no User has any more. Folds
+        that run meanwhile may be lost until the next reconcile."""
+        names = set(User._rank_group_names())
+        names.update(counters.names_with_prefix(RANK_BUCKET_PREFIX))
+        names.update(counts)
+        current = counters.get_counts(list(names))
+        for name in names:
+            if current[name] != counts.get(name, 0):
+                counters.set_count(name, counts.get(name, 0))
 
     def to_rankings_form(self):
         """Returns UserRankingForm representation of user rankings."""
@@ -28,6 +383,44 @@ class User(ndb.Model):
             total_games=self.total_games)
 
 
+class UserStatShard(ndb.Model):
+    """Completed games of a User not yet folded onto it. Keyed by
+    '<urlsafe User key>:<index>' rather than under the User, so games
+    ending at once do not contend on one entity group."""
+    total_games = ndb.IntegerProperty(default=0, indexed=False)
+    wins = ndb.IntegerProperty(default=0, indexed=False)
+    misses = ndb.IntegerProperty(default=0, indexed=False)
+    won_games_difficulty = ndb.IntegerProperty(default=0, indexed=False)
+    # dirty is True while the shard has games to fold.
+    dirty = ndb.BooleanProperty(default=False)
+
+    @staticmethod
+    def user_key(key):
+        """Returns the User key of a stat shard key."""
+        return ndb.Key(urlsafe=key.id().rsplit(':', 1)[0])
+
+    def add(self, won, misses, difficulty):
+        """Counts a completed game."""
+        self.total_games += 1
+        self.misses += misses
+        if won:
+            self.wins += 1
+            self.won_games_difficulty += difficulty
+        self.dirty = True
+
+    def clear(self):
+        """Resets the shard once its games were folded."""
+        self.total_games = self.wins = self.misses = 0
+        self.won_games_difficulty = 0
+        self.dirty = False
+
+
+# The Game properties a move changes. Moves are saved by copying them onto
+# the stored game, so changes made to it elsewhere are kept.
+MOVE_PROPERTIES = ('guessed_word', 'missed_letters', 'guessed_mask',
+                   'misses_left', 'moves', 'last_move')
+
+
 class Game(ndb.Model):
     """Game Object"""
     allowed_misses = ndb.IntegerProperty(required=True, default=6)
@@ -39,38 +432,185 @@ class Game(ndb.Model):
     # have dashes for letters that have not been guessed yet.
     guessed_word = ndb.StringProperty(required=True)
     missed_letters = ndb.StringProperty(required=True, default='')
+    # guessed_mask has one bit set for each guessed letter (a is bit 0).
+    # It is None for games created before it was added.
+    guessed_mask = ndb.IntegerProperty(indexed=False)
     # misses can be between 6 and 10. 6 is default so the frontend
     # could represent head, body, 2 arms and 2 legs for the hangman
     # picture. At 10 you could add hands and feet.
     misses_left = ndb.IntegerProperty(required=True, default=6)
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
-    # turn_history will be array of OrderedDicts and converted
-    # to JSON before being returned by endpoint.
-    turn_history = ndb.PickleProperty(default=[])
+    # user_name is copied from the User so forms can be rendered without
+    # fetching the User. Use resolve_user_names for older games.
+    user_name = ndb.StringProperty()
+    # moves is the ordered string of guesses, uppercase for hits and
+    # lowercase for misses. Messages and word snapshots for the turn
+    # history are rebuilt from it on read.
+    moves = ndb.StringProperty(indexed=False, default='')
+    # turn_history is the legacy array of OrderedDicts. It is converted
+    # to moves the next time the game is saved.
+    turn_history = ndb.PickleProperty()
+    # last_move is when the game was created or last moved in. The
+    # sweeper expires idle games and archives finished ones by it.
+    last_move = ndb.DateTimeProperty()
 
-    @classmethod
-    def new_game(cls, user, allowed_misses):
-        """Creates a new game"""
+    @staticmethod
+    def _check_allowed_misses(allowed_misses):
         if allowed_misses < 6 or allowed_misses > 10:
-            raise ValueError('Allowed misses must be between 6 and 10')
-        secret_word = random.choice(Game.generate_word_list())
-        game = Game(user=user,
-                    allowed_misses=allowed_misses,
-                    secret_word=secret_word,
-                    difficulty=Game.check_word_difficulty(secret_word),
-                    guessed_word=("-" * len(secret_word)),
-                    missed_letters='',
-                    misses_left=allowed_misses,
-                    game_over=False)
-        game.put()
-        return game
+            raise ValueError('Allowed misses must be between 6 and 10!')
+
+    @classmethod
+    def _create(cls, user, user_name, allowed_misses, entry):
+        """Returns an unsaved new game of the secret word entry."""
+        return cls(user=user,
+                   user_name=user_name,
+                   allowed_misses=allowed_misses,
+                   secret_word=entry.word,
+                   difficulty=entry.difficulty,
+                   guessed_word=("-" * entry.length),
+                   missed_letters='',
+                   guessed_mask=0,
+                   misses_left=allowed_misses,
+                   game_over=False,
+                   last_move=datetime.now())
+
+    @classmethod
+    @ndb.tasklet
+    def new_game_async(cls, user, allowed_misses, min_difficulty=None,
+                       max_difficulty=None, min_length=None,
+                       max_length=None, user_name=None):
+        """Creates a new game and returns a future for it. The secret word
+        is drawn from the words within the optional difficulty and length
+        ranges."""
+        cls._check_allowed_misses(allowed_misses)
+        entry = get_word_index().choice(min_difficulty=min_difficulty,
+                                        max_difficulty=max_difficulty,
+                                        min_length=min_length,
+                                        max_length=max_length)
+        game = cls._create(user, user_name, allowed_misses, entry)
+        yield (game.put_async(),
+               Game.count_active_async(games=1, misses_left=allowed_misses))
+        raise ndb.Return(game)
+
+    @classmethod
+    @ndb.tasklet
+    def new_games_async(cls, users, allowed_misses, min_difficulty=None,
+                        max_difficulty=None, min_length=None,
+                        max_length=None):
+        """Creates a new game for each User in users and returns a future
+        for the list of games. The secret words are sampled together, the
+        games are saved with one batched put and the active game counters
+        are updated once."""
+        cls._check_allowed_misses(allowed_misses)
+        entries = get_word_index().sample(len(users),
+                                          min_difficulty=min_difficulty,
+                                          max_difficulty=max_difficulty,
+                                          min_length=min_length,
+                                          max_length=max_length)
+        games = [cls._create(user.key, user.name, allowed_misses, entry)
+                 for user, entry in zip(users, entries)]
+        yield (ndb.put_multi_async(games),
+               Game.count_active_async(games=len(games),
+                                       misses_left=len(games) *
+                                       allowed_misses))
+        raise ndb.Return(games)
+
+    @staticmethod
+    @ndb.tasklet
+    def count_active_async(games=0, misses_left=0):
+        """Adjusts the running totals of active games and of their
+        misses left."""
+        yield (counters.increment_async(ACTIVE_GAMES, games),
+               counters.increment_async(ACTIVE_MISSES_LEFT, misses_left))
+
+    @staticmethod
+    @ndb.tasklet
+    def average_misses_left_async():
+        """Returns a future for the average misses left of active games,
+        or for None if there are no active games."""
+        counts = yield counters.get_counts_async([ACTIVE_GAMES,
+                                                  ACTIVE_MISSES_LEFT])
+        if counts[ACTIVE_GAMES] < 1:
+            raise ndb.Return(None)
+        raise ndb.Return(
+            counts[ACTIVE_MISSES_LEFT] / float(counts[ACTIVE_GAMES]))
+
+    @staticmethod
+    def reconcile_active_counters(cursor=None, games=0, misses_left=0,
+                                  page_size=1000):
+        """Adds one page of active games to the games and misses_left
+        totals, using a projection query. Returns (cursor, games,
+        misses_left); cursor is None once the last page was added and the
+        counters were replaced with the recomputed totals."""
+        page, next_cursor, more = \
+            Game.query(Game.game_over == False).fetch_page(
+                page_size, projection=[Game.misses_left],
+                start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+        games += len(page)
+        misses_left += sum(game.misses_left for game in page)
+        if more and next_cursor:
+            return next_cursor.urlsafe(), games, misses_left
+        counters.set_count(ACTIVE_GAMES, games)
+        counters.set_count(ACTIVE_MISSES_LEFT, misses_left)
+        return None, games, misses_left
+
+    def engine(self):
+        """Returns a GameEngine for the current game state."""
+        guessed_mask = self.guessed_mask
+        if guessed_mask is None:
+            guessed_mask = letters_mask(self.missed_letters +
+                                        self.guessed_word.replace('-', ''))
+        return GameEngine(self.secret_word, self.misses_left,
+                          guessed_mask=guessed_mask,
+                          missed_letters=self.missed_letters)
+
+    def sync_engine(self, engine):
+        """Copies the state of a GameEngine back onto the game."""
+        self.guessed_mask = engine.guessed_mask
+        self.misses_left = engine.misses_left
+        self.missed_letters = engine.missed_letters
+        self.guessed_word = engine.guessed_word
+        self.last_move = datetime.now()
+
+    def record_move(self, letter, result):
+        """Appends a HIT or MISS to the turn history."""
+        self.moves += encode_move(letter, result)
+
+    def history(self):
+        """Returns the turn history as a list of OrderedDicts with the
+        guess, result and word for each turn."""
+        if not self.moves and self.turn_history:
+            return self.turn_history
+        return history_from_moves(self.secret_word, self.allowed_misses,
+                                  self.moves)
+
+    def _pre_put_hook(self):
+        self.convert_turn_history()
+
+    def convert_turn_history(self):
+        """Converts a legacy turn_history to moves."""
+        if self.turn_history:
+            if not self.moves:
+                self.moves = ''.join(
+                    encode_move(turn['guess'],
+                                HIT if turn['guess'] in self.secret_word
+                                else MISS)
+                    for turn in self.turn_history)
+            self.turn_history = None
+
+    @ndb.tasklet
+    def to_form_async(self, message):
+        """Returns a future for a GameForm representation of the Game."""
+        if not self.user_name:
+            yield resolve_user_names_async([self])
+        raise ndb.Return(self.to_form(message))
 
     def to_form(self, message):
         """Retuns a GameForm representation of the Game."""
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = self.user_name or self.user.get().name
         form.misses_left = self.misses_left
         form.missed_letters = self.missed_letters
         form.guessed_word = self.guessed_word
@@ -78,70 +618,234 @@ class Game(ndb.Model):
         form.message = message
         return form
 
-    def end_game(self, won=False):
-        """Ends the game."""
+    def to_list_form(self, user_name, message):
+        """Returns a GameForm for an active game of the User user_name
+        read by a projection query on GAME_LIST_PROJECTION."""
+        return GameForm(urlsafe_key=self.key.urlsafe(),
+                        user_name=user_name,
+                        misses_left=self.misses_left,
+                        missed_letters=self.missed_letters,
+                        guessed_word=self.guessed_word,
+                        game_over=False,
+                        message=message)
+
+    @ndb.tasklet
+    def _merge_moves_async(self, previous_moves):
+        """Returns a future for (stored, misses_left): the stored copy of
+        the game with the moves made on this copy copied onto it, and its
+        misses left before them. previous_moves are this copy's moves
+        before them. Returns a future for (None, None) if the stored game
+        was deleted, ended or moved in since. Call it in a transaction."""
+        stored = yield self.key.get_async()
+        if stored is None or stored.game_over:
+            raise ndb.Return(None, None)
+        stored.convert_turn_history()
+        if stored.moves != previous_moves:
+            raise ndb.Return(None, None)
+        misses_left = stored.misses_left
+        for name in MOVE_PROPERTIES:
+            setattr(stored, name, getattr(self, name))
+        raise ndb.Return(stored, misses_left)
+
+    @ndb.tasklet
+    def save_moves_async(self, previous_moves):
+        """Saves the moves made on this copy of an active game since its
+        moves were previous_moves and takes their misses off the active
+        game counters. Only the properties moves change are written, onto
+        the stored game re-read in a transaction. Returns a future for
+        False, without saving, if the stored game was deleted, ended or
+        moved in since."""
+        @ndb.tasklet
+        def _save():
+            stored, misses_left = yield self._merge_moves_async(
+                previous_moves)
+            if stored is None:
+                raise ndb.Return(None)
+            yield stored.put_async()
+            raise ndb.Return(misses_left - stored.misses_left)
+        misses = yield ndb.transaction_async(_save)
+        if misses is None:
+            raise ndb.Return(False)
+        if misses:
+            yield Game.count_active_async(misses_left=-misses)
+        raise ndb.Return(True)
+
+    @ndb.tasklet
+    def end_game_async(self, previous_moves, won=False):
+        """Ends the game with the moves made on this copy since its moves
+        were previous_moves and returns a future for its Score, or for
+        None if the stored game was deleted, ended or moved in since. The
+        stored game is re-read and saved with the moves, along with its
+        Score and the game's count in a stat shard of the User, in one
+        cross-group transaction; the User is updated when the shards are
+        folded."""
         self.game_over = True
-        self.put()
-        # Add the game to the score 'board'
-        score = Score(user=self.user, date=date.today(), won=won,
-                      misses=self.allowed_misses - self.misses_left,
-                      difficulty=self.difficulty)
-        score.put()
-        user = User.query(User.key == self.user).get()
-        # Add data to User Object for ranking users.
-        user.total_games += 1
-        user.misses += self.allowed_misses - self.misses_left
-        user.avg_misses = user.misses / float(user.total_games)
-        if won:
-            user.wins += 1
-            user.won_games_difficulty += self.difficulty
-            user.avg_won_difficulty = \
-                user.won_games_difficulty / float(user.wins)
-        user.win_ratio = user.wins / float(user.total_games)
-        user.put()
+
+        @ndb.tasklet
+        def _commit():
+            stored, misses_left = yield self._merge_moves_async(
+                previous_moves)
+            if stored is None:
+                raise ndb.Return(None)
+            stored.game_over = True
+            # Add the game to the score 'board'
+            score = Score(user=stored.user,
+                          user_name=stored.user_name or self.user_name,
+                          date=date.today(), won=won,
+                          misses=stored.allowed_misses - stored.misses_left,
+                          difficulty=stored.difficulty)
+            yield (ndb.put_multi_async([stored, score]),
+                   User.record_game_async(stored.user, won, score.misses,
+                                          stored.difficulty))
+            raise ndb.Return(score, misses_left)
+        result = yield ndb.transaction_async(_commit, xg=True)
+        if result is None:
+            raise ndb.Return(None)
+        score, misses_left = result
+        yield Game.count_active_async(games=-1, misses_left=-misses_left)
+        raise ndb.Return(score)
+
+    @staticmethod
+    @ndb.tasklet
+    def cancel_async(key):
+        """Deletes an active game in a transaction, so a game ended or
+        deleted meanwhile is left alone, and takes it off the active game
+        counters. Returns a future for False if it was not deleted."""
+        @ndb.tasklet
+        def _delete():
+            game = yield key.get_async()
+            if game is None or game.game_over:
+                raise ndb.Return(None)
+            yield key.delete_async()
+            raise ndb.Return(game.misses_left)
+        misses_left = yield ndb.transaction_async(_delete)
+        if misses_left is None:
+            raise ndb.Return(False)
+        yield Game.count_active_async(games=-1, misses_left=-misses_left)
+        raise ndb.Return(True)
 
     @staticmethod
     def generate_word_list():
         """Returns secret word list."""
-        word_list = []
-        with open('words.csv', 'r') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                word_list.append(row[0])
-        return word_list
+        return get_word_index().words
 
     @staticmethod
     def check_word_difficulty(secret_word):
         """ Returns a word difficulty score."""
-        # Add 1 to difficulty for each unique letter
-        unique_letters = ''.join(set(secret_word))
-        difficulty = len(unique_letters)
-        # Add additional points to difficulty for infrequent letters
-        for c in secret_word:
-            if c in "jqxz":
-                difficulty += 4
-            elif c in "bkv":
-                difficulty += 3
-            elif c in "cfgmpwy":
-                difficulty += 2
-        return difficulty
+        return word_difficulty(secret_word)
+
+
+class GameArchive(ndb.Model):
+    """Compact record of a finished or expired Game, keyed by the id of
+    the Game it replaces. Only what get_game_history needs is kept, and
+    nothing is indexed."""
+    user = ndb.KeyProperty(kind='User', indexed=False)
+    secret_word = ndb.StringProperty(indexed=False)
+    allowed_misses = ndb.IntegerProperty(indexed=False)
+    moves = ndb.StringProperty(indexed=False)
+    last_move = ndb.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def key_for_game(cls, game_key):
+        """Returns the archive key of a Game key."""
+        return ndb.Key(cls, game_key.id())
+
+    @classmethod
+    def from_game(cls, game):
+        """Returns an unsaved archive of game."""
+        game.convert_turn_history()
+        return cls(key=cls.key_for_game(game.key), user=game.user,
+                   secret_word=game.secret_word,
+                   allowed_misses=game.allowed_misses, moves=game.moves,
+                   last_move=game.last_move)
+
+    def history(self):
+        """Returns the turn history like Game.history."""
+        return history_from_moves(self.secret_word, self.allowed_misses,
+                                  self.moves)
+
+
+def history_from_moves(secret_word, allowed_misses, moves):
+    """Returns the turn history of an encoded moves string as a list of
+    OrderedDicts with the guess, result and word for each turn."""
+    history = []
+    for guess, result, word in replay(secret_word, allowed_misses, moves):
+        # Used OrderedDict so it maintains the proper order.
+        turn = OrderedDict()
+        turn['guess'] = guess
+        turn['result'] = result
+        turn['word'] = word
+        history.append(turn)
+    return history
 
 
 class Score(ndb.Model):
     """Score Object"""
     user = ndb.KeyProperty(required=True, kind='User')
+    # Copied from the User like Game.user_name.
+    user_name = ndb.StringProperty()
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     misses = ndb.IntegerProperty(required=True)
     difficulty = ndb.IntegerProperty(required=True)
 
     def to_form(self):
-        return ScoreForm(user_name=self.user.get().name,
+        return ScoreForm(user_name=self.user_name or self.user.get().name,
+                         won=self.won,
+                         date=str(self.date),
+                         misses=self.misses,
+                         difficulty=self.difficulty)
+
+    def to_list_form(self, user_name):
+        """Returns a ScoreForm for a Score of the User user_name read by a
+        projection query on SCORE_LIST_PROJECTION."""
+        return ScoreForm(user_name=user_name,
                          won=self.won,
                          date=str(self.date),
                          misses=self.misses,
                          difficulty=self.difficulty)
 
+    @staticmethod
+    @ndb.tasklet
+    def to_forms_async(scores):
+        """Returns a future for ScoreForms for a list of scores with one
+        batched User lookup."""
+        yield resolve_user_names_async(scores)
+        raise ndb.Return([score.to_form() for score in scores])
+
+    @staticmethod
+    def to_forms(scores):
+        """Returns ScoreForms for a list of scores."""
+        return Score.to_forms_async(scores).get_result()
+
+
+# Properties fetched by the per-user list endpoints. The User is known
+# from the request, so its name is not projected.
+GAME_LIST_PROJECTION = (Game.guessed_word, Game.missed_letters,
+                        Game.misses_left)
+SCORE_LIST_PROJECTION = (Score.date, Score.difficulty, Score.misses,
+                         Score.won)
+
+
+@ndb.tasklet
+def resolve_user_names_async(entities):
+    """Fills in user_name on Games or Scores saved before it was copied
+    from the User, fetching all of the referenced Users in one batch."""
+    keys = list(set(entity.user for entity in entities
+                    if not entity.user_name))
+    if not keys:
+        return
+    users = yield ndb.get_multi_async(keys)
+    names = dict((user.key, user.name) for user in users if user)
+    for entity in entities:
+        if not entity.user_name:
+            entity.user_name = names.get(entity.user)
+
+
+def resolve_user_names(entities):
+    """Fills in user_name on Games or Scores missing it."""
+    resolve_user_names_async(entities).get_result()
+
 
 class GameForm(messages.Message):
     """GameForm for outbound game state information"""
@@ -159,6 +863,33 @@ class MakeMoveForm(messages.Message):
     guess = messages.StringField(1, required=True)
 
 
+class MakeMovesForm(messages.Message):
+    """Used to make several moves in an existing game."""
+    guesses = messages.StringField(1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Result of one of several moves (result is hit, miss or repeat)."""
+    guess = messages.StringField(1, required=True)
+    result = messages.StringField(2, required=True)
+    message = messages.StringField(3, required=True)
+
+
+class MoveResultForms(messages.Message):
+    """Return the results of several moves and the final game state."""
+    results = messages.MessageField(MoveResultForm, 1, repeated=True)
+    game = messages.MessageField(GameForm, 2, required=True)
+
+
+class HintForm(messages.Message):
+    """Return the suggested next guess for a game."""
+    letter = messages.StringField(1, required=True)
+    # Number of words consistent with the game so far, and of those the
+    # number containing letter.
+    candidates = messages.IntegerField(2, required=True)
+    candidates_with_letter = messages.IntegerField(3, required=True)
+
+
 class ScoreForm(messages.Message):
     user_name = messages.StringField(1, required=True)
     date = messages.StringField(2, required=True)
@@ -171,16 +902,58 @@ class NewGameForm(messages.Message):
     """Used to create a new game."""
     user_name = messages.StringField(1, required=True)
     allowed_misses = messages.IntegerField(2, default=6)
+    # Optional ranges the secret word is drawn from.
+    min_difficulty = messages.IntegerField(3)
+    max_difficulty = messages.IntegerField(4)
+    min_length = messages.IntegerField(5)
+    max_length = messages.IntegerField(6)
 
 
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms."""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    # cursor of the next page, if there is one.
+    cursor = messages.StringField(2)
 
 
 class UserGameForms(messages.Message):
     """Returns multiple GameForms for a specific user."""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    # cursor of the next page, if there is one.
+    cursor = messages.StringField(2)
+
+
+class GameForms(messages.Message):
+    """Return multiple GameForms."""
+    items = messages.MessageField(GameForm, 1, repeated=True)
+
+
+class NewUserForm(messages.Message):
+    """Used to create one of several users."""
+    user_name = messages.StringField(1, required=True)
+    email = messages.StringField(2)
+
+
+class NewUsersForm(messages.Message):
+    """Used to create several users."""
+    users = messages.MessageField(NewUserForm, 1, repeated=True)
+
+
+class NewUsersResultForm(messages.Message):
+    """Return the names of the users created and of those that already
+    existed."""
+    created = messages.StringField(1, repeated=True)
+    existing = messages.StringField(2, repeated=True)
+
+
+class NewGamesForm(messages.Message):
+    """Used to create a new game for each of several users."""
+    user_names = messages.StringField(1, repeated=True)
+    allowed_misses = messages.IntegerField(2, default=6)
+    min_difficulty = messages.IntegerField(3)
+    max_difficulty = messages.IntegerField(4)
+    min_length = messages.IntegerField(5)
+    max_length = messages.IntegerField(6)
 
 
 class UserRankingForm(messages.Message):
@@ -198,6 +971,15 @@ class UserRankingForms(messages.Message):
     items = messages.MessageField(UserRankingForm, 1, repeated=True)
 
 
+class UserRankForm(messages.Message):
+    """Return a User's rank with the Users ranked around them."""
+    rank = messages.IntegerField(1, required=True)
+    total_ranked = messages.IntegerField(2, required=True)
+    user = messages.MessageField(UserRankingForm, 3, required=True)
+    above = messages.MessageField(UserRankingForm, 4, repeated=True)
+    below = messages.MessageField(UserRankingForm, 5, repeated=True)
+
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     message = messages.StringField(1, required=True)
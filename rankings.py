@@ -0,0 +1,115 @@
+"""rankings.py - Rank of a single User without scanning the rankings.
+
+Ranked Users are counted by their place in the rank order: by win_ratio
+into rank groups (User.rank_group), and Users with the same win_ratio by
+avg_misses into rank buckets (User.rank_bucket). Every group, and every
+bucket of a win_ratio, has a sharded counter of its Users, kept current
+when completed games are folded onto Users and corrected daily by
+/tasks/reconcile_rank_buckets. A User's rank is the number of Users in
+better groups, read from the counters, plus a count query for the Users
+in their own group with a higher win_ratio, plus the Users with their
+win_ratio in better buckets, read from the counters, plus count queries
+for the better Users in their own bucket. Neighbors are read from the
+Users closest to them in the rank order, without offsets."""
+
+from google.appengine.ext import ndb
+
+from models import User
+
+# Users ranked by win ratio, then average misses, then average difficulty
+# of won games.
+RANK_ORDER = (-User.win_ratio, User.avg_misses, -User.avg_won_difficulty)
+REVERSE_RANK_ORDER = (User.win_ratio, -User.avg_misses,
+                      User.avg_won_difficulty)
+
+
+def _better_difficulty(user):
+    """Returns the filter of won difficulties ranked above user's."""
+    if user.avg_won_difficulty is None:
+        # Users without wins sort after those with a won difficulty.
+        return User.avg_won_difficulty != None
+    return User.avg_won_difficulty > user.avg_won_difficulty
+
+
+@ndb.tasklet
+def _better_in_bucket_async(user, bucket):
+    """Returns a future for the number of Users with user's win_ratio in
+    their rank bucket ranked above user. The count queries run
+    concurrently."""
+    tied = User.win_ratio == user.win_ratio
+    counts = yield (
+        User.query(tied, User.rank_bucket == bucket,
+                   User.avg_misses < user.avg_misses).count_async(),
+        User.query(tied, User.avg_misses == user.avg_misses,
+                   _better_difficulty(user)).count_async())
+    raise ndb.Return(sum(counts))
+
+
+@ndb.tasklet
+def _above_async(user, number):
+    """Returns a future for up to number Users ranked directly above user,
+    best first. The closest Users with the same average misses, with fewer
+    misses and with a higher win ratio are fetched concurrently."""
+    tied = User.win_ratio == user.win_ratio
+    queries = (
+        User.query(tied, User.avg_misses == user.avg_misses,
+                   _better_difficulty(user)).order(User.avg_won_difficulty),
+        User.query(tied, User.avg_misses < user.avg_misses).order(
+            -User.avg_misses, User.avg_won_difficulty),
+        User.query(User.win_ratio > user.win_ratio).order(
+            *REVERSE_RANK_ORDER))
+    pages = yield [query.fetch_async(number) for query in queries]
+    closest = [other for page in pages for other in page][:number]
+    raise ndb.Return(list(reversed(closest)))
+
+
+@ndb.tasklet
+def _below_async(user, number):
+    """Returns a future for up to number Users ranked directly below user,
+    best first. Users tied with user come first, then the closest Users
+    with the same average misses, with more misses and with a lower win
+    ratio, fetched concurrently."""
+    tied = User.win_ratio == user.win_ratio
+    same_misses = User.avg_misses == user.avg_misses
+    queries = [User.query(tied, same_misses, User.avg_won_difficulty ==
+                          user.avg_won_difficulty)]
+    if user.avg_won_difficulty is not None:
+        queries.extend([
+            User.query(tied, same_misses,
+                       User.avg_won_difficulty < user.avg_won_difficulty
+                       ).order(-User.avg_won_difficulty),
+            User.query(tied, same_misses, User.avg_won_difficulty == None)])
+    queries.extend([
+        User.query(tied, User.avg_misses > user.avg_misses).order(
+            User.avg_misses, -User.avg_won_difficulty),
+        User.query(User.win_ratio < user.win_ratio).order(*RANK_ORDER)])
+    # One more than number, in case user is among them.
+    pages = yield [query.fetch_async(number + 1) for query in queries]
+    below, seen = [], set([user.key])
+    for other in (other for page in pages for other in page):
+        if other.key not in seen:
+            seen.add(other.key)
+            below.append(other)
+    raise ndb.Return(below[:number])
+
+
+@ndb.tasklet
+def get_rank_async(user, neighbors=0):
+    """Returns a future for (rank, total_ranked, above, below) for a ranked
+    User, where above and below are lists of up to neighbors Users ranked
+    directly above and below them. Tied Users share a rank."""
+    group = User.group_for(user.win_ratio)
+    bucket = User.bucket_for(user.avg_misses)
+    groups, buckets, in_group, in_bucket = yield (
+        User.rank_group_counts_async(),
+        User.rank_bucket_counts_async(user.win_ratio),
+        User.query(User.rank_group == group,
+                   User.win_ratio > user.win_ratio).count_async(),
+        _better_in_bucket_async(user, bucket))
+    rank = (sum(groups[group + 1:]) + in_group +
+            sum(buckets[bucket + 1:]) + in_bucket + 1)
+    above, below = [], []
+    if neighbors:
+        above, below = yield (_above_async(user, neighbors),
+                              _below_async(user, neighbors))
+    raise ndb.Return(rank, sum(groups), above, below)
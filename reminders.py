@@ -0,0 +1,96 @@
+"""reminders.py - Reminder emails for users with active games.
+
+The cron handler starts a chain of page tasks. Each page task reads one
+cursor page of distinct users with active games through a projection
+query, fetches those users with one get_multi and fans the sends out to
+worker tasks in batches before enqueuing the next page. Task names are
+derived from the run and page, so a retried task never enqueues a page
+or a batch twice, and a run can be resumed from any page's cursor. Runs
+are identified by their UTC date, so the reminders go out at most once a
+day however often the cron URL is requested."""
+
+import json
+import logging
+import time
+from datetime import datetime
+from google.appengine.api import app_identity, mail, taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game
+
+PAGE_SIZE = 500
+SEND_BATCH_SIZE = 50
+PAGE_URL = '/tasks/reminders/page'
+SEND_URL = '/tasks/reminders/send'
+
+
+def _add_tasks(tasks):
+    """Adds named tasks, skipping any that were already added."""
+    for task in tasks:
+        try:
+            task.add()
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            logging.info('Task %s was already added', task.name)
+
+
+def start(run_id=None):
+    """Enqueues the first page of a reminder run and returns its id, which
+    is today's UTC date unless run_id is given."""
+    run_id = run_id or datetime.utcnow().strftime('%Y-%m-%d')
+    enqueue_page(run_id, 0, None, 0, time.time())
+    return run_id
+
+
+def enqueue_page(run_id, page, cursor, emailed, started):
+    """Enqueues a page task of a reminder run."""
+    params = {'run_id': run_id, 'page': page, 'emailed': emailed,
+              'started': started}
+    if cursor:
+        params['cursor'] = cursor
+    _add_tasks([taskqueue.Task(url=PAGE_URL, params=params,
+                               name='reminder-{}-page-{}'.format(run_id,
+                                                                 page))])
+
+
+def process_page(run_id, page, cursor, emailed, started,
+                 page_size=PAGE_SIZE):
+    """Fans out the sends for one page of users with active games and
+    enqueues the next page. Returns the number of users emailed so far."""
+    games, next_cursor, more = \
+        Game.query(Game.game_over == False).fetch_page(
+            page_size, projection=[Game.user], distinct=True,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    users = ndb.get_multi([game.user for game in games])
+    recipients = [(user.name, user.email) for user in users
+                  if user and user.email]
+    batches = [recipients[i:i + SEND_BATCH_SIZE]
+               for i in range(0, len(recipients), SEND_BATCH_SIZE)]
+    _add_tasks([taskqueue.Task(url=SEND_URL, payload=json.dumps(batch),
+                               name='reminder-{}-page-{}-batch-{}'.format(
+                                   run_id, page, index))
+                for index, batch in enumerate(batches)])
+    emailed += len(recipients)
+    if more and next_cursor:
+        enqueue_page(run_id, page + 1, next_cursor.urlsafe(), emailed,
+                     started)
+    else:
+        logging.info('Reminder run %s emailed %d users in %.1f seconds',
+                     run_id, emailed, time.time() - started)
+    return emailed
+
+
+def send_batch(recipients):
+    """Sends a reminder email to each (name, email) in recipients."""
+    sender = 'noreply@{}.appspotmail.com'.format(
+        app_identity.get_application_id())
+    subject = 'Reminder: Time to play Hangman!'
+    for name, email in recipients:
+        body = 'Hello {}, you have at least one active game at' \
+               'hangman-game-api.appspot.com! Time to take a ' \
+               'turn!'.format(name)
+        # This will send test emails, the arguments to send_mail are:
+        # from, to, subject, body
+        mail.send_mail(sender, email, subject, body)
+    return len(recipients)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""simulate.py - Offline simulation to recalibrate word difficulty.
+
+Plays games of every secret word with the hint solver, where each guess
+is the solver's best letter except that with probability --epsilon it is
+a random unguessed letter, like a less careful player. The mean misses of
+each word are then fitted by least squares to the features word_difficulty
+scores (unique letters and occurrences of each infrequent letter group),
+and the fitted weights are reported as JSON next to the current ones,
+with how well each set of weights predicts the simulated misses.
+
+    python simulate.py --games 1000000 --output weights.json
+"""
+
+import argparse
+import json
+import random
+import string
+import sys
+from collections import OrderedDict
+
+from engine import GameEngine
+from solver import get_solver
+from word_index import (LETTER_WEIGHTS, UNIQUE_LETTER_WEIGHT,
+                        get_word_index, word_difficulty)
+
+# Most game states whose best letter the simulator remembers.
+MEMO_SIZE = 100000
+
+
+def features(word, letter_weights=LETTER_WEIGHTS):
+    """Returns the features word_difficulty weighs: the number of unique
+    letters and the occurrences of each infrequent letter group."""
+    return [len(set(word))] + [sum(1 for c in word if c in letters)
+                               for letters, _ in letter_weights]
+
+
+class Simulator(object):
+    """Plays games against the solver's index, remembering the best
+    letter of the MEMO_SIZE game states it ranked most recently. A state
+    is the revealed word and the guessed letters, which determine the
+    candidates, so the memo is not keyed by the candidate bitsets."""
+
+    def __init__(self, solver, allowed_misses, epsilon, rng):
+        self.solver = solver
+        self.allowed_misses = allowed_misses
+        self.epsilon = epsilon
+        self.random = rng
+        self._best = OrderedDict()
+
+    def _best_letter(self, index, candidates, engine, guessed):
+        state = (id(index), engine.guessed_mask, engine.guessed_word)
+        letter = self._best.pop(state, None)
+        if letter is None:
+            ranked = index.rank(candidates, guessed)
+            letter = ranked[0][0] if ranked else self._random_letter(guessed)
+            if len(self._best) >= MEMO_SIZE:
+                self._best.popitem(last=False)
+        # Most recently used states are kept last.
+        self._best[state] = letter
+        return letter
+
+    def _random_letter(self, guessed):
+        return self.random.choice([letter
+                                   for letter in string.ascii_lowercase
+                                   if letter not in guessed])
+
+    def play(self, word):
+        """Plays one game of word and returns the number of misses."""
+        engine = GameEngine(word, self.allowed_misses)
+        index = self.solver.lengths[len(word)]
+        candidates = index.all
+        guessed = set()
+        while not engine.over:
+            if self.random.random() < self.epsilon:
+                letter = self._random_letter(guessed)
+            else:
+                letter = self._best_letter(index, candidates, engine,
+                                           guessed)
+            guessed.add(letter)
+            engine.guess(letter)
+            candidates = index.narrow(candidates, letter,
+                                      engine.positions.get(letter, ()))
+        return self.allowed_misses - engine.misses_left
+
+
+def least_squares(rows, targets, weights):
+    """Returns the coefficients b minimising the weighted squared error of
+    rows . b against targets, solving the normal equations by Gaussian
+    elimination. A tiny ridge term keeps unused features at zero. The
+    matrix is built of floats, since rows and weights may be ints."""
+    size = len(rows[0])
+    matrix = [[sum(float(w) * row[i] * row[j]
+                   for row, w in zip(rows, weights)) +
+               (1e-9 if i == j else 0) for j in range(size)] +
+              [sum(float(w) * row[i] * y for row, y, w
+                   in zip(rows, targets, weights))]
+              for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda r: abs(matrix[r][column]))
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        for row in range(size):
+            if row != column and matrix[column][column]:
+                factor = matrix[row][column] / matrix[column][column]
+                matrix[row] = [a - factor * b for a, b
+                               in zip(matrix[row], matrix[column])]
+    return [matrix[i][size] / matrix[i][i] if matrix[i][i] else 0.0
+            for i in range(size)]
+
+
+def correlation(xs, ys):
+    """Returns the Pearson correlation of two equal length sequences."""
+    n = float(len(xs))
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if not var_x or not var_y:
+        return None
+    return cov / (var_x * var_y) ** 0.5
+
+
+def calibrate(results):
+    """Returns the fitted weights for results, a dict of word to (games,
+    total misses), scaled to the current mean difficulty and rounded."""
+    words = sorted(word for word in results if results[word][0])
+    rows = [[1] + features(word) for word in words]
+    targets = [float(results[word][1]) / results[word][0] for word in words]
+    coefficients = least_squares(rows, targets,
+                                 [results[word][0] for word in words])
+    slopes = coefficients[1:]
+    # Misses per feature are rescaled so the mean difficulty of the word
+    # list stays where it is, which keeps difficulty bounds in requests
+    # meaningful.
+    current = [word_difficulty(word) for word in words]
+    fitted = [sum(s * f for s, f in zip(slopes, features(word)))
+              for word in words]
+    mean_fitted = sum(fitted) / len(fitted)
+    scale = (sum(current) / float(len(current)) / mean_fitted
+             if mean_fitted > 0 else 1.0)
+    weights = [max(0, int(round(s * scale))) for s in slopes]
+    unique_letter_weight = weights[0]
+    letter_weights = tuple((letters, weight) for (letters, _), weight
+                           in zip(LETTER_WEIGHTS, weights[1:]))
+    suggested = [word_difficulty(word, unique_letter_weight, letter_weights)
+                 for word in words]
+    return {
+        'misses_per_feature': {
+            'intercept': coefficients[0],
+            'correlation': correlation(fitted, targets),
+            'unique_letter': slopes[0],
+            'letter_groups': dict((letters, slope) for (letters, _), slope
+                                  in zip(LETTER_WEIGHTS, slopes[1:])),
+        },
+        'current': {
+            'unique_letter_weight': UNIQUE_LETTER_WEIGHT,
+            'letter_weights': LETTER_WEIGHTS,
+            'correlation': correlation(current, targets),
+        },
+        'suggested': {
+            'unique_letter_weight': unique_letter_weight,
+            'letter_weights': letter_weights,
+            'correlation': correlation(suggested, targets),
+        },
+        'words': dict((word, {'games': results[word][0],
+                              'mean_misses': target,
+                              'difficulty': difficulty,
+                              'suggested_difficulty': new})
+                      for word, target, difficulty, new
+                      in zip(words, targets, current, suggested)),
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--allowed-misses', type=int, default=6)
+    parser.add_argument('--epsilon', type=float, default=0.2,
+                        help='chance of guessing a random letter')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the JSON report to')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv if argv is not None else sys.argv[1:])
+    rng = random.Random(options.seed)
+    words = get_word_index().words
+    simulator = Simulator(get_solver(), options.allowed_misses,
+                          options.epsilon, rng)
+    results = dict((word, [0, 0]) for word in words)
+    for game in range(options.games):
+        # Every word is played equally often.
+        word = words[game % len(words)]
+        results[word][0] += 1
+        results[word][1] += simulator.play(word)
+    report = calibrate(results)
+    report['options'] = vars(options)
+    report = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""solver.py - Hint engine that ranks the next letter to guess.
+
+Words of each length are numbered, and for every position and letter the
+index keeps a bitset, a Python int, of the words with that letter at that
+position, along with a bitset per letter of the words containing it. The
+words consistent with a game are found with a few ANDs of those bitsets,
+and letters are ranked by how many of the remaining words contain them.
+The index has no datastore dependencies so offline simulations can use
+it too."""
+
+import threading
+
+from word_index import get_word_index
+
+# Most frequent letters in English words first, used to break ties and
+# when no indexed word fits a game.
+FREQUENCY_ORDER = 'etaoinshrdlcumwfgypbvkjxqz'
+_FREQUENCY_RANK = dict((letter, rank)
+                       for rank, letter in enumerate(FREQUENCY_ORDER))
+
+
+def popcount(bits):
+    """Returns the number of set bits in a non-negative int."""
+    return bin(bits).count('1')
+
+
+class LengthIndex(object):
+    """Position and letter bitsets of the words of one length."""
+    __slots__ = ('words', 'all', 'at', 'contains')
+
+    def __init__(self, words):
+        self.words = words
+        self.all = (1 << len(words)) - 1
+        # at[position][letter] and contains[letter] are bitsets of words.
+        self.at = [{} for _ in range(len(words[0]))]
+        self.contains = {}
+        for number, word in enumerate(words):
+            bit = 1 << number
+            for position, letter in enumerate(word):
+                self.at[position][letter] = \
+                    self.at[position].get(letter, 0) | bit
+            for letter in set(word):
+                self.contains[letter] = self.contains.get(letter, 0) | bit
+
+    def narrow(self, candidates, letter, positions):
+        """Returns the candidates bitset without the words that do not have
+        letter at exactly positions. An empty positions is a miss."""
+        if not positions:
+            return candidates & ~self.contains.get(letter, 0)
+        for position, letters in enumerate(self.at):
+            bits = letters.get(letter, 0)
+            candidates &= bits if position in positions else ~bits
+        return candidates
+
+    def rank(self, candidates, guessed=''):
+        """Returns (letter, words) pairs for the letters not in guessed that
+        appear in any candidate word, best first, where words is the number
+        of candidates containing the letter."""
+        counts = [(popcount(candidates & bits), letter)
+                  for letter, bits in self.contains.iteritems()
+                  if letter not in guessed]
+        counts = [(letter, words) for words, letter in counts if words]
+        counts.sort(key=lambda count: (
+            -count[1], _FREQUENCY_RANK.get(count[0], len(FREQUENCY_ORDER))))
+        return counts
+
+
+class Solver(object):
+    """Length-indexed bitsets over a word list."""
+
+    def __init__(self, words):
+        by_length = {}
+        for word in words:
+            by_length.setdefault(len(word), []).append(word)
+        self.lengths = dict((length, LengthIndex(words))
+                            for length, words in by_length.iteritems())
+
+    def candidates(self, guessed_word, missed_letters):
+        """Returns (length_index, candidates) for a game, where candidates
+        is the bitset of the words consistent with its guessed_word (dashes
+        for hidden letters) and missed_letters. length_index is None if no
+        word has the length of the game's word."""
+        index = self.lengths.get(len(guessed_word))
+        if index is None:
+            return None, 0
+        candidates = index.all
+        for letter in set(guessed_word) - set('-'):
+            positions = frozenset(position for position, revealed
+                                  in enumerate(guessed_word)
+                                  if revealed == letter)
+            candidates = index.narrow(candidates, letter, positions)
+        for letter in missed_letters:
+            candidates = index.narrow(candidates, letter, ())
+        return index, candidates
+
+    def hint(self, guessed_word, missed_letters):
+        """Returns (letter, candidates, words) for the best next guess of a
+        game, where candidates is the number of words consistent with it
+        and words the number of those containing letter. If no word fits,
+        the most frequent unguessed letter is returned with zero counts.
+        Returns None once every letter was guessed."""
+        guessed = set(guessed_word) | set(missed_letters)
+        index, candidates = self.candidates(guessed_word, missed_letters)
+        if candidates:
+            ranked = index.rank(candidates, guessed)
+            if ranked:
+                letter, words = ranked[0]
+                return letter, popcount(candidates), words
+        for letter in FREQUENCY_ORDER:
+            if letter not in guessed:
+                return letter, 0, 0
+        return None
+
+
+_solver = {'entries': None, 'solver': None}
+_lock = threading.Lock()
+
+
+def get_solver():
+    """Returns the process-wide Solver over the secret word list, rebuilt
+    when the word list is reloaded."""
+    index = get_word_index()
+    index.refresh()
+    entries = index.entries
+    if _solver['entries'] is not entries:
+        with _lock:
+            if _solver['entries'] is not entries:
+                _solver['solver'] = Solver([entry.word
+                                            for entry in entries])
+                _solver['entries'] = entries
+    return _solver['solver']
@@ -0,0 +1,134 @@
+"""sweeper.py - Expires idle games and archives finished ones.
+
+A daily cron job starts a sweep, which runs through its phases as a
+chain of tasks on the rate-limited sweeper queue, one cursor page of
+Games per task:
+ - expire: ends active Games idle for longer than IDLE_TTL, without a
+   Score, and takes them off the active game counters.
+ - archive: replaces Games that finished more than ARCHIVE_AFTER ago
+   with a compact GameArchive that get_game_history falls back to.
+Games saved before last_move existed are only swept once
+/tasks/migrate/last_move has given them one. The cutoffs are fixed when
+the sweep starts, so a failed task is retried from its own cursor. Task
+names are derived from the sweep, phase and page, so a page is never
+enqueued twice."""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import game_cache
+from models import Game, GameArchive
+
+# Active games without a move for this long are expired.
+IDLE_TTL = timedelta(days=7)
+# Finished games are archived this long after their last move.
+ARCHIVE_AFTER = timedelta(days=1)
+BATCH_SIZE = 100
+QUEUE = 'sweeper'
+URL = '/tasks/sweep'
+PHASES = ('expire', 'archive')
+
+
+def _query(phase, started, idle_ttl):
+    """Returns the query of the Games a phase works on."""
+    if phase == 'expire':
+        return Game.query(Game.game_over == False,
+                          Game.last_move < started - idle_ttl)
+    return Game.query(Game.game_over == True,
+                      Game.last_move < started - ARCHIVE_AFTER)
+
+
+def start(idle_ttl=IDLE_TTL):
+    """Enqueues the first page of a sweep and returns its id."""
+    started = int(time.time())
+    enqueue_page(str(started), PHASES[0], 0, None, started,
+                 int(idle_ttl.total_seconds()))
+    return str(started)
+
+
+def enqueue_page(run_id, phase, page, cursor, started, idle_ttl):
+    """Enqueues a page task of a sweep."""
+    params = {'run_id': run_id, 'phase': phase, 'page': page,
+              'started': started, 'idle_ttl': idle_ttl}
+    if cursor:
+        params['cursor'] = cursor
+    try:
+        taskqueue.Task(url=URL, params=params,
+                       name='sweep-{}-{}-{}'.format(run_id, phase, page)).add(
+            queue_name=QUEUE)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        logging.info('Sweep page %s %s %d was already added', run_id,
+                     phase, page)
+
+
+def process_page(run_id, phase, page, cursor, started, idle_ttl,
+                 batch_size=BATCH_SIZE):
+    """Sweeps one page of a phase and enqueues the next page, or the first
+    page of the next phase. Returns the number of Games changed."""
+    started_at = datetime.fromtimestamp(started)
+    keys, next_cursor, more = _query(
+        phase, started_at, timedelta(seconds=idle_ttl)).fetch_page(
+            batch_size, keys_only=True,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    if phase == 'expire':
+        changed = _expire(keys, started_at - timedelta(seconds=idle_ttl))
+    else:
+        changed = _archive(keys)
+    logging.info('Sweep %s %s page %d changed %d games', run_id, phase,
+                 page, changed)
+    if more and next_cursor:
+        enqueue_page(run_id, phase, page + 1, next_cursor.urlsafe(),
+                     started, idle_ttl)
+    elif phase != PHASES[-1]:
+        enqueue_page(run_id, PHASES[PHASES.index(phase) + 1], 0, None,
+                     started, idle_ttl)
+    return changed
+
+
+def _expire_async(key, cutoff):
+    """Ends an idle active game in a transaction, so a move saved since
+    the query keeps it active. Returns a future for its misses left, or
+    for None if it was not expired."""
+    @ndb.tasklet
+    def _end():
+        game = yield key.get_async()
+        if (not game or game.game_over or game.last_move is None or
+                game.last_move >= cutoff):
+            raise ndb.Return(None)
+        game.game_over = True
+        yield game.put_async()
+        raise ndb.Return(game.misses_left)
+    return ndb.transaction_async(_end)
+
+
+def _expire(keys, cutoff):
+    # The games are evicted before they are ended, so no move saves a
+    # cached copy of one afterwards.
+    game_cache.delete_multi(keys)
+    # A retry after the counters failed to update leaves them off until
+    # the daily /tasks/cache_average_misses recount.
+    futures = [_expire_async(key, cutoff) for key in keys]
+    expired = [(key, future.get_result())
+               for key, future in zip(keys, futures)
+               if future.get_result() is not None]
+    if expired:
+        Game.count_active_async(
+            games=-len(expired),
+            misses_left=-sum(misses for _, misses in expired)).get_result()
+    return len(expired)
+
+
+def _archive(keys):
+    games = [game for game in ndb.get_multi(keys)
+             if game and game.game_over]
+    # The archives are written first, so a retry after a failure between
+    # the two writes archives the same games again.
+    ndb.put_multi([GameArchive.from_game(game) for game in games])
+    game_cache.delete_multi([game.key for game in games])
+    ndb.delete_multi([game.key for game in games])
+    return len(games)
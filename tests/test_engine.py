@@ -0,0 +1,101 @@
+"""test_engine.py - Tests of the game state engine."""
+
+import unittest
+
+from engine import (GameEngine, HIT, MISS, REPEAT, decode_moves,
+                    encode_move, letters_mask, replay)
+
+
+class GameEngineTest(unittest.TestCase):
+
+    def test_hit_reveals_every_position(self):
+        engine = GameEngine('array', 6)
+        self.assertEqual(engine.guess('r'), HIT)
+        self.assertEqual(engine.guessed_word, '-rr--')
+        self.assertEqual(engine.misses_left, 6)
+        self.assertEqual(engine.missed_letters, '')
+
+    def test_miss_uses_a_miss(self):
+        engine = GameEngine('array', 6)
+        self.assertEqual(engine.guess('z'), MISS)
+        self.assertEqual(engine.misses_left, 5)
+        self.assertEqual(engine.missed_letters, 'z')
+        self.assertEqual(engine.guessed_word, '-----')
+
+    def test_repeat_changes_nothing(self):
+        engine = GameEngine('array', 6)
+        engine.guess('a')
+        engine.guess('z')
+        self.assertEqual(engine.guess('a'), REPEAT)
+        self.assertEqual(engine.guess('z'), REPEAT)
+        self.assertEqual(engine.misses_left, 5)
+        self.assertEqual(engine.missed_letters, 'z')
+
+    def test_rejects_non_letters(self):
+        engine = GameEngine('array', 6)
+        for guess in ('1', 'A', '', 'ab'):
+            self.assertRaises(ValueError, engine.guess, guess)
+
+    def test_win(self):
+        engine = GameEngine('loop', 6)
+        for letter in 'lop':
+            self.assertFalse(engine.over)
+            engine.guess(letter)
+        self.assertTrue(engine.won)
+        self.assertFalse(engine.lost)
+        self.assertTrue(engine.over)
+        self.assertEqual(engine.guessed_word, 'loop')
+
+    def test_loss(self):
+        engine = GameEngine('loop', 6)
+        for letter in 'abcdef':
+            engine.guess(letter)
+        self.assertTrue(engine.lost)
+        self.assertFalse(engine.won)
+        self.assertTrue(engine.over)
+        self.assertEqual(engine.misses_left, 0)
+
+    def test_resumes_from_saved_state(self):
+        engine = GameEngine('loop', 6)
+        engine.guess('o')
+        engine.guess('z')
+        resumed = GameEngine('loop', engine.misses_left,
+                             guessed_mask=engine.guessed_mask,
+                             missed_letters=engine.missed_letters)
+        self.assertEqual(resumed.guessed_word, '-oo-')
+        self.assertEqual(resumed.guess('o'), REPEAT)
+        self.assertEqual(resumed.guess('z'), REPEAT)
+        self.assertEqual(letters_mask('oz'), resumed.guessed_mask)
+
+
+class MovesEncodingTest(unittest.TestCase):
+
+    def test_encode_decode_round_trip(self):
+        moves = [('a', HIT), ('z', MISS), ('r', HIT)]
+        encoded = ''.join(encode_move(letter, result)
+                          for letter, result in moves)
+        self.assertEqual(encoded, 'AzR')
+        self.assertEqual(list(decode_moves(encoded)),
+                         [('a', True), ('z', False), ('r', True)])
+
+    def test_replay_matches_engine(self):
+        engine = GameEngine('array', 6)
+        moves = ''
+        expected = []
+        for letter in 'azry':
+            result = engine.guess(letter)
+            moves += encode_move(letter, result)
+            expected.append((letter, engine.guessed_word))
+        turns = list(replay('array', 6, moves))
+        self.assertEqual([(guess, word) for guess, _, word in turns],
+                         expected)
+        self.assertIn('You win!', turns[-1][1])
+
+    def test_replay_of_a_loss(self):
+        turns = list(replay('loop', 6, 'abcdef'))
+        self.assertEqual(len(turns), 6)
+        self.assertIn('You lost!', turns[-1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
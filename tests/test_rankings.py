@@ -0,0 +1,107 @@
+"""test_rankings.py - Tests of get_user_rank against the get_user_rankings
+order, using the App Engine testbed stubs. Skipped without the App
+Engine SDK."""
+
+import unittest
+
+try:
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb, testbed
+except ImportError:
+    testbed = None
+else:
+    import api
+    from models import User
+
+# (name, wins, total_games, misses, won_games_difficulty). Win ratios in
+# one rank group differ by less than 0.01, with the lower ratio having
+# fewer misses, and several Users share a win ratio.
+USERS = [
+    ('ada', 509, 1000, 3000, 1527),
+    ('bob', 501, 1000, 200, 1503),
+    ('cy', 1, 2, 1, 3),
+    ('dee', 1, 2, 4, 5),
+    ('eve', 1, 2, 4, 2),
+    ('fay', 0, 2, 6, 0),
+    ('gus', 0, 1, 1, 0),
+    ('hal', 2, 2, 0, 8),
+    ('ivy', 1, 2, 12, 4),
+    ('jo', 103, 200, 150, 309),
+]
+
+
+def rank_key(user):
+    """The get_user_rankings order as a sort key, best first."""
+    return (-user.win_ratio, user.avg_misses,
+            -(user.avg_won_difficulty or float('-inf')))
+
+
+@unittest.skipIf(testbed is None, 'requires the App Engine SDK')
+class RankingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+        self.api = api.HangmanApi()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def add_users(self, users):
+        for name, wins, total_games, misses, difficulty in users:
+            user = User(key=User.key_for_name(name), name=name)
+            user.add_stats(total_games, wins, misses, difficulty)
+            user.put()
+            User.count_rank_buckets_async(
+                None, user.rank_position()).get_result()
+
+    def rankings(self):
+        request = api.USER_RANKINGS_REQUEST.combined_message_class(
+            number_of_results=len(USERS))
+        return self.api.get_user_rankings(request).items
+
+    def rank(self, name, neighbors):
+        request = api.USER_RANK_REQUEST.combined_message_class(
+            user_name=name, number_of_neighbors=neighbors)
+        return self.api.get_user_rank(request)
+
+    def test_rank_and_neighbors_follow_the_rankings(self):
+        self.add_users(USERS)
+        names = [item.user_name for item in self.rankings()]
+        self.assertEqual(len(names), len(USERS))
+        for position, name in enumerate(names):
+            form = self.rank(name, 3)
+            self.assertEqual(form.rank, position + 1, name)
+            self.assertEqual(form.total_ranked, len(USERS))
+            self.assertEqual([other.user_name for other in form.above],
+                             names[max(0, position - 3):position], name)
+            self.assertEqual([other.user_name for other in form.below],
+                             names[position + 1:position + 4], name)
+
+    def test_a_higher_ratio_in_the_group_ranks_first(self):
+        self.add_users(USERS[:2])
+        self.assertEqual([item.user_name for item in self.rankings()],
+                         ['ada', 'bob'])
+        self.assertEqual(self.rank('ada', 0).rank, 1)
+        self.assertEqual(self.rank('bob', 0).rank, 2)
+
+    def test_tied_users_share_a_rank(self):
+        self.add_users(USERS + [('kit', 1, 2, 4, 5)])
+        users = ndb.get_multi([User.key_for_name(name)
+                               for name, _, _, _, _ in USERS])
+        dee = User.key_for_name('dee').get()
+        expected = 1 + sum(1 for user in users
+                           if rank_key(user) < rank_key(dee))
+        self.assertEqual(self.rank('dee', 0).rank, expected)
+        self.assertEqual(self.rank('kit', 0).rank, expected)
+        self.assertIn('kit', [other.user_name
+                              for other in self.rank('dee', 1).below])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""test_reminders.py - Tests of the reminder email fan-out against the
+App Engine testbed stubs. Skipped without the App Engine SDK."""
+
+import json
+import os
+import time
+import unittest
+
+try:
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb, testbed
+except ImportError:
+    testbed = None
+else:
+    import reminders
+    from models import Game, User
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@unittest.skipIf(testbed is None, 'requires the App Engine SDK')
+class RemindersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.taskqueue = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        self.batch_size = reminders.SEND_BATCH_SIZE
+
+    def tearDown(self):
+        reminders.SEND_BATCH_SIZE = self.batch_size
+        self.testbed.deactivate()
+
+    def add_user(self, name, email, games=(False,)):
+        """Saves a User with a Game for each game_over value in games."""
+        user = User(key=User.key_for_name(name), name=name, email=email)
+        user.put()
+        for game_over in games:
+            Game(user=user.key, user_name=name, secret_word='loop',
+                 difficulty=3, guessed_word='----', misses_left=6,
+                 game_over=game_over).put()
+
+    def send_batches(self):
+        tasks = self.taskqueue.get_filtered_tasks(url=reminders.SEND_URL)
+        return [json.loads(task.payload) for task in tasks]
+
+    def page_tasks(self):
+        return self.taskqueue.get_filtered_tasks(url=reminders.PAGE_URL)
+
+    def test_process_page_fans_out_users_with_active_games(self):
+        self.add_user('ada', 'ada@example.com', games=(False, False))
+        self.add_user('bob', 'bob@example.com')
+        self.add_user('cy', None)
+        self.add_user('dee', 'dee@example.com', games=(True,))
+        reminders.SEND_BATCH_SIZE = 1
+        emailed = reminders.process_page('run', 0, None, 0, time.time())
+        self.assertEqual(emailed, 2)
+        batches = self.send_batches()
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(sorted(tuple(recipient) for batch in batches
+                                for recipient in batch),
+                         [('ada', 'ada@example.com'),
+                          ('bob', 'bob@example.com')])
+        self.assertEqual(self.page_tasks(), [])
+
+    def test_process_page_enqueues_the_next_page(self):
+        for name in ('ada', 'bob', 'cy'):
+            self.add_user(name, '{}@example.com'.format(name))
+        reminders.process_page('run', 0, None, 0, time.time(), page_size=2)
+        tasks = self.page_tasks()
+        self.assertEqual([task.name for task in tasks],
+                         ['reminder-run-page-1'])
+        self.assertIn('cursor=', tasks[0].payload)
+        self.assertIn('emailed=2', tasks[0].payload)
+
+    def test_retried_page_adds_no_tasks_twice(self):
+        self.add_user('ada', 'ada@example.com')
+        for _ in range(2):
+            reminders.process_page('run', 0, None, 0, time.time())
+        self.assertEqual(len(self.send_batches()), 1)
+
+    def test_run_is_started_once_a_day(self):
+        first = reminders.start()
+        self.assertEqual(reminders.start(), first)
+        self.assertEqual(len(self.page_tasks()), 1)
+
+    def test_send_batch_emails_each_recipient(self):
+        sent = reminders.send_batch([['ada', 'ada@example.com'],
+                                     ['bob', 'bob@example.com']])
+        self.assertEqual(sent, 2)
+        messages = self.mail.get_sent_messages(to='ada@example.com')
+        self.assertEqual(len(messages), 1)
+        self.assertIn('Hello ada', messages[0].body.decode())
+        self.assertEqual(
+            len(self.mail.get_sent_messages(to='bob@example.com')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""test_simulate.py - Tests of the difficulty calibration fit."""
+
+import random
+import unittest
+
+from simulate import correlation, features, least_squares
+
+
+class LeastSquaresTest(unittest.TestCase):
+
+    def test_recovers_coefficients_from_integer_rows(self):
+        rng = random.Random(0)
+        coefficients = [1, 2, -1, 3]
+        rows = [[1] + [rng.randint(0, 5) for _ in range(3)]
+                for _ in range(200)]
+        targets = [sum(c * x for c, x in zip(coefficients, row))
+                   for row in rows]
+        weights = [rng.randint(1, 10) for _ in rows]
+        fitted = least_squares(rows, targets, weights)
+        for expected, actual in zip(coefficients, fitted):
+            self.assertAlmostEqual(actual, expected, places=6)
+
+    def test_unused_feature_gets_zero(self):
+        rows = [[1, x, 0] for x in range(10)]
+        targets = [2 + 0.5 * x for x in range(10)]
+        fitted = least_squares(rows, targets, [1] * 10)
+        self.assertAlmostEqual(fitted[0], 2, places=6)
+        self.assertAlmostEqual(fitted[1], 0.5, places=6)
+        self.assertAlmostEqual(fitted[2], 0, places=6)
+
+
+class FeaturesTest(unittest.TestCase):
+
+    def test_counts_unique_letters_and_letter_groups(self):
+        self.assertEqual(features('jazz', (('jqxz', 4), ('bkv', 3))),
+                         [3, 3, 0])
+
+    def test_correlation(self):
+        self.assertAlmostEqual(correlation([1, 2, 3], [2, 4, 6]), 1.0)
+        self.assertIsNone(correlation([1, 1, 1], [1, 2, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
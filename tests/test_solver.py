@@ -0,0 +1,61 @@
+"""test_solver.py - Tests of the hint solver's bitset index."""
+
+import unittest
+
+from solver import FREQUENCY_ORDER, Solver, popcount
+
+WORDS = ['loop', 'look', 'pool', 'tool', 'heap', 'array', 'stack']
+
+
+class SolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.solver = Solver(WORDS)
+
+    def words(self, guessed_word, missed_letters=''):
+        index, candidates = self.solver.candidates(guessed_word,
+                                                   missed_letters)
+        return sorted(word for number, word in enumerate(index.words)
+                      if candidates >> number & 1)
+
+    def test_every_word_of_the_length_fits_a_new_game(self):
+        self.assertEqual(self.words('----'),
+                         ['heap', 'look', 'loop', 'pool', 'tool'])
+
+    def test_hit_narrows_to_exact_positions(self):
+        self.assertEqual(self.words('-oo-'),
+                         ['look', 'loop', 'pool', 'tool'])
+        self.assertEqual(self.words('l---'), ['look', 'loop'])
+        # A revealed letter is not at any hidden position.
+        self.assertEqual(self.words('---l'), ['pool', 'tool'])
+
+    def test_miss_removes_words_with_the_letter(self):
+        self.assertEqual(self.words('-oo-', 'p'), ['look', 'tool'])
+        self.assertEqual(self.words('----', 'o'), ['heap'])
+
+    def test_no_word_of_the_length(self):
+        self.assertEqual(self.solver.candidates('---------', ''), (None, 0))
+
+    def test_hint_is_the_letter_in_most_candidates(self):
+        letter, candidates, words = self.solver.hint('-oo-', 'p')
+        self.assertEqual(candidates, 2)
+        self.assertEqual((letter, words), ('l', 2))
+        letter, candidates, words = self.solver.hint('----', '')
+        # o and l are each in four words, and o is more frequent.
+        self.assertEqual((letter, candidates, words), ('o', 5, 4))
+
+    def test_hint_without_candidates_uses_letter_frequency(self):
+        self.assertEqual(self.solver.hint('----', 'olhe'),
+                         (FREQUENCY_ORDER[1], 0, 0))
+
+    def test_no_hint_once_every_letter_was_guessed(self):
+        self.assertIsNone(self.solver.hint('-----', FREQUENCY_ORDER))
+
+    def test_popcount(self):
+        self.assertEqual(popcount(0), 0)
+        self.assertEqual(popcount(0b101101), 4)
+        self.assertEqual(popcount(1 << 200), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""test_word_index.py - Tests of the secret word index."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from word_index import WordIndex, word_difficulty
+
+WORDS = ['loop', 'array', 'Loop', 'quicksort', 'stack', 'queue', '']
+
+
+class WordIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'words.csv')
+        self.write(WORDS)
+        self.index = WordIndex(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, words):
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(words) + '\n')
+
+    def test_loads_unique_lowercase_words(self):
+        self.assertEqual(self.index.words,
+                         ['loop', 'array', 'quicksort', 'stack', 'queue'])
+
+    def test_buckets_by_difficulty_and_length(self):
+        self.index.refresh()
+        for (difficulty, length), bucket in self.index.buckets.iteritems():
+            for entry in bucket:
+                self.assertEqual(entry.difficulty,
+                                 word_difficulty(entry.word))
+                self.assertEqual(entry.length, length)
+                self.assertEqual(entry.difficulty, difficulty)
+        self.assertEqual(sum(len(bucket)
+                             for bucket in self.index.buckets.values()), 5)
+
+    def test_choice_within_ranges(self):
+        for _ in range(50):
+            entry = self.index.choice(min_length=5, max_length=5)
+            self.assertIn(entry.word, ('array', 'stack', 'queue'))
+        easiest = min(word_difficulty(word) for word in self.index.words)
+        for _ in range(20):
+            entry = self.index.choice(max_difficulty=easiest)
+            self.assertEqual(entry.difficulty, easiest)
+
+    def test_sample_draws_count_words_within_ranges(self):
+        entries = self.index.sample(200, min_length=5)
+        self.assertEqual(len(entries), 200)
+        self.assertTrue(all(entry.length >= 5 for entry in entries))
+        # Every matching word is drawn from a sample this large.
+        self.assertEqual(set(entry.word for entry in entries),
+                         set(['array', 'quicksort', 'stack', 'queue']))
+
+    def test_no_matching_words(self):
+        self.assertRaises(ValueError, self.index.choice, min_length=20)
+        self.assertRaises(ValueError, self.index.sample, 3,
+                          min_difficulty=5, max_difficulty=4)
+
+    def test_reloads_when_the_file_changes(self):
+        self.assertEqual(len(self.index.words), 5)
+        self.write(['heap'])
+        mtime = os.path.getmtime(self.path) + 10
+        os.utime(self.path, (mtime, mtime))
+        self.assertEqual(self.index.words, ['heap'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,106 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+import threading
+from collections import OrderedDict
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-import endpoints
 
-# Code from Udacity https://github.com/udacity/FSND-P4-Design-A-Game
-def get_by_urlsafe(urlsafe, model):
-    """Returns an ndb.Model entity that the urlsafe key points to. Checks
-        that the type of entity returned is of the correct kind. Raises an
-        error if the key String is malformed or the entity is of the incorrect
-        kind
-    Args:
-        urlsafe: A urlsafe key string
-        model: The expected entity kind
-    Returns:
-        The entity that the urlsafe Key string points to or None if no entity
-        exists.
-    Raises:
-        ValueError:"""
+
+def bad_request(message):
+    """Returns an endpoints.BadRequestException with message."""
+    # endpoints is imported here so task and cron handlers that use this
+    # module do not load the Endpoints stack.
+    import endpoints
+    return endpoints.BadRequestException(message)
+
+
+def _invalid_key():
+    return bad_request('Invalid Key')
+
+
+def key_from_urlsafe(urlsafe):
+    """Returns the ndb.Key for a urlsafe key string. Raises
+    BadRequestException if the key String is malformed."""
     try:
-        key = ndb.Key(urlsafe=urlsafe)
+        return ndb.Key(urlsafe=urlsafe)
     except TypeError:
-        raise endpoints.BadRequestException('Invalid Key')
+        raise _invalid_key()
     except Exception, e:
         if e.__class__.__name__ == 'ProtocolBufferDecodeError':
-            raise endpoints.BadRequestException('Invalid Key')
+            raise _invalid_key()
         else:
             raise
 
-    entity = key.get()
-    if not entity:
+
+def cursor_from_urlsafe(urlsafe):
+    """Returns the Cursor for a urlsafe cursor string, or None if it is
+    empty. Raises BadRequestException if the string is malformed."""
+    if not urlsafe:
         return None
+    try:
+        return Cursor(urlsafe=urlsafe)
+    except datastore_errors.BadValueError:
+        raise bad_request('Invalid cursor')
+
+
+# Code from Udacity https://github.com/udacity/FSND-P4-Design-A-Game
+@ndb.tasklet
+def get_by_urlsafe_async(urlsafe, model):
+    """Returns a future for the ndb.Model entity that the urlsafe key
+        points to. Checks that the type of entity returned is of the correct
+        kind. Raises an error if the key String is malformed or the entity
+        is of the incorrect kind
+    Args:
+        urlsafe: A urlsafe key string
+        model: The expected entity kind
+    Returns:
+        A future for the entity that the urlsafe Key string points to or
+        None if no entity exists.
+    Raises:
+        ValueError:"""
+    key = key_from_urlsafe(urlsafe)
+    entity = yield key.get_async()
+    if not entity:
+        raise ndb.Return(None)
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
-    return entity
+    raise ndb.Return(entity)
+
+
+class LRUCache(object):
+    """Thread-safe in-process cache that evicts the least recently used
+    item once it holds more than max_size items."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default."""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        """Caches value for key."""
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """Removes key from the cache."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,60 @@
+"""warmup.py - Preloads an instance before it serves traffic.
+
+App Engine sends /_ah/warmup to new instances before routing requests
+to them. Warming parses the word list, builds the hint solver's index,
+fills the in-process leaderboard copy and the memcache totals of the
+counters read by the API, and imports the API module, which builds the
+Endpoints request containers and the API server. The API and task
+handlers run in the same process, so the first API request on the
+instance finds all of this done."""
+
+import logging
+import time
+from collections import OrderedDict
+
+
+def _load_word_index():
+    from word_index import get_word_index
+    get_word_index().refresh()
+
+
+def _build_solver():
+    from solver import get_solver
+    get_solver()
+
+
+def _load_leaderboard():
+    import leaderboard
+    leaderboard.get_board()
+
+
+def _load_counters():
+    from models import Game, User
+    Game.average_misses_left_async().check_success()
+    User.rank_group_counts_async().check_success()
+
+
+def _import_api():
+    import api
+
+
+STEPS = (('word_index', _load_word_index),
+         ('solver', _build_solver),
+         ('leaderboard', _load_leaderboard),
+         ('counters', _load_counters),
+         ('api', _import_api))
+
+
+def warm_up():
+    """Runs every warmup step and returns an OrderedDict of the
+    milliseconds each took. A failed step is logged and skipped, since
+    the instance can still serve without it."""
+    timings = OrderedDict()
+    for name, step in STEPS:
+        start = time.time()
+        try:
+            step()
+        except Exception:
+            logging.exception('Warmup step %s failed', name)
+        timings[name] = 1000 * (time.time() - start)
+    return timings
@@ -0,0 +1,157 @@
+"""word_index.py - Process-wide index of the secret word list.
+
+The word list is parsed once per instance and reloaded only when the
+modification time of words.csv changes. Every word is stored with its
+precomputed difficulty, length and letter set, and words are bucketed by
+(difficulty, length) so that a random word can be drawn without scanning
+the list."""
+
+import csv
+import os
+import random
+import threading
+from collections import namedtuple
+
+WORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'words.csv')
+
+WordEntry = namedtuple('WordEntry', ['word', 'difficulty', 'length',
+                                     'letters'])
+
+
+# Difficulty points per unique letter, and per occurrence of a letter in
+# each group of infrequent letters. simulate.py fits these weights to the
+# misses of simulated games.
+UNIQUE_LETTER_WEIGHT = 1
+LETTER_WEIGHTS = (('jqxz', 4), ('bkv', 3), ('cfgmpwy', 2))
+
+
+def word_difficulty(word, unique_letter_weight=UNIQUE_LETTER_WEIGHT,
+                    letter_weights=LETTER_WEIGHTS):
+    """Returns a word difficulty score."""
+    # Add points to difficulty for each unique letter
+    difficulty = unique_letter_weight * len(set(word))
+    # Add additional points to difficulty for infrequent letters
+    for c in word:
+        for letters, weight in letter_weights:
+            if c in letters:
+                difficulty += weight
+                break
+    return difficulty
+
+
+class WordIndex(object):
+    """Words from a csv file bucketed by difficulty and length."""
+
+    def __init__(self, path=WORDS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.entries = []
+        self.buckets = {}
+
+    @property
+    def words(self):
+        """Returns the list of indexed words."""
+        self.refresh()
+        return [entry.word for entry in self.entries]
+
+    def refresh(self):
+        """Reloads the word list if the file changed since the last load."""
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+
+    def _load(self):
+        """Parses the csv file and rebuilds the buckets."""
+        entries = []
+        buckets = {}
+        seen = set()
+        with open(self.path, 'r') as f:
+            for row in csv.reader(f):
+                if not row:
+                    continue
+                word = row[0].strip().lower()
+                if not word or word in seen:
+                    continue
+                seen.add(word)
+                entry = WordEntry(word=word,
+                                  difficulty=word_difficulty(word),
+                                  length=len(word),
+                                  letters=frozenset(word))
+                entries.append(entry)
+                buckets.setdefault((entry.difficulty, entry.length),
+                                   []).append(entry)
+        # Swap both at once so readers never see a half built index.
+        self.entries, self.buckets = entries, buckets
+
+    def _matching(self, min_difficulty, max_difficulty, min_length,
+                  max_length):
+        """Returns the buckets within the given ranges and their total
+        size."""
+        self.refresh()
+        if (min_difficulty is None and max_difficulty is None and
+                min_length is None and max_length is None):
+            buckets = [self.entries]
+        else:
+            buckets = [bucket for (difficulty, length), bucket
+                       in self.buckets.iteritems()
+                       if _in_range(difficulty, min_difficulty,
+                                    max_difficulty)
+                       and _in_range(length, min_length, max_length)]
+        total = sum(len(bucket) for bucket in buckets)
+        if not total:
+            raise ValueError('No words match the requested difficulty '
+                             'and length!')
+        return buckets, total
+
+    def choice(self, min_difficulty=None, max_difficulty=None,
+               min_length=None, max_length=None):
+        """Returns a random WordEntry within the given difficulty and
+        length ranges. Any bound left as None is unbounded.
+        Raises:
+            ValueError: if no word falls within the ranges."""
+        return self.sample(1, min_difficulty, max_difficulty, min_length,
+                           max_length)[0]
+
+    def sample(self, count, min_difficulty=None, max_difficulty=None,
+               min_length=None, max_length=None):
+        """Returns a list of count random WordEntries within the given
+        ranges, drawn independently, so words may repeat. The matching
+        buckets are walked once for the whole sample.
+        Raises:
+            ValueError: if no word falls within the ranges."""
+        buckets, total = self._matching(min_difficulty, max_difficulty,
+                                        min_length, max_length)
+        # Positions in the concatenated buckets make every matching word
+        # equally likely to be drawn.
+        positions = sorted(random.randrange(total) for _ in range(count))
+        entries = []
+        offset = 0
+        bucket_iter = iter(buckets)
+        bucket = next(bucket_iter)
+        for position in positions:
+            while position >= offset + len(bucket):
+                offset += len(bucket)
+                bucket = next(bucket_iter)
+            entries.append(bucket[position - offset])
+        random.shuffle(entries)
+        return entries
+
+
+def _in_range(value, low, high):
+    """Returns True if value lies within the optional [low, high] range."""
+    return ((low is None or value >= low) and
+            (high is None or value <= high))
+
+
+_word_index = WordIndex()
+
+
+def get_word_index():
+    """Returns the process-wide WordIndex."""
+    return _word_index